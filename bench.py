@@ -0,0 +1,327 @@
+"""
+Loopback benchmarks for the video and control links, runnable without a display, a joystick
+or the PWM board.
+
+Each run starts a server script and its client as subprocesses talking over 127.0.0.1, with
+the SDL dummy video driver in place of a display, the 'sweep' input backend (see
+control_input.py) in place of a joystick and the simulated PWM backend in place of the
+PCA9685. They dump their metrics (see metrics.py) as JSON lines, in windows as long as the run.
+The first window of each process covers starting up and is only used as the baseline; the
+figures reported come from the second.
+
+For every codec and chunk size the video runs report frames/sec, MB/s of encoded frames,
+datagrams per second each way, CPU time per frame on each end and the per-stage and
+glass-to-glass latency percentiles. The control run reports command rates, CPU use and the
+input-to-actuation latency percentiles.
+
+Given impairments, the clients talk to the servers through udp_relay.py with those settings,
+to see how the links hold up on a poor network.
+
+Results are written to a JSON file, along with the commit they were taken on, so runs can be
+compared. Usage:
+
+    bench.py <output JSON> [<seconds per run> [<codecs> [<chunk sizes> [<impairments>]]]]
+
+Codecs and chunk sizes are comma separated lists, e.g. raw,zlib:1,jpeg:75 and 1451,8192,60000,
+and impairments are as for udp_relay.py, e.g. loss=0.02,delay=10,jitter=5,seed=1.
+"""
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from video_protocol import CHUNK_SIZE
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SECONDS = 3.0
+DEFAULT_CODECS = ('raw', 'zlib:1', 'jpeg:75')
+DEFAULT_CHUNK_SIZES = (CHUNK_SIZE, 8192, 60000)
+# How long a process may take to start up before its first metrics window
+STARTUP_TIMEOUT = 10.0
+
+HEADLESS_ENV = {
+    'SDL_VIDEODRIVER': 'dummy',
+    'SDL_AUDIODRIVER': 'dummy',
+    'RPICAR_PWM_BACKEND': 'sim',
+    'PYGAME_HIDE_SUPPORT_PROMPT': '1',
+}
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_bind(port, process, timeout=STARTUP_TIMEOUT):
+    """
+    Wait until something has bound UDP `port`, i.e. the server `process` is listening.
+    """
+    give_up_at = time.monotonic() + timeout
+    while time.monotonic() < give_up_at:
+        process.check()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(('127.0.0.1', port))
+        except OSError:
+            return
+        finally:
+            sock.close()
+        time.sleep(0.05)
+    raise Exception("{:} never started listening on port {:}".format(process.name, port))
+
+
+class BenchProcess:
+    """
+    One of the scripts, run headless with its metrics dumped to a file in `work_dir`.
+    """
+    def __init__(self, work_dir, script, args, interval):
+        self.name = script
+        self.metrics_path = os.path.join(work_dir, script + '.jsonl')
+        self.log_path = os.path.join(work_dir, script + '.log')
+        env = dict(
+            os.environ, RPICAR_METRICS=self.metrics_path,
+            RPICAR_METRICS_INTERVAL=str(interval), **HEADLESS_ENV
+        )
+        with open(self.log_path, 'w') as log:
+            self.process = subprocess.Popen(
+                [sys.executable, os.path.join(HERE, script)] + [str(arg) for arg in args],
+                cwd=HERE, env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=log
+            )
+
+    def windows(self):
+        if not os.path.exists(self.metrics_path):
+            return []
+        with open(self.metrics_path) as f:
+            return [json.loads(line) for line in f if line.endswith('\n')]
+
+    def check(self):
+        """
+        Raise if the process has died, with the end of its output.
+        """
+        if self.process.poll() is None:
+            return
+        with open(self.log_path) as f:
+            output = f.read()[-2000:]
+        raise Exception("{:} exited with status {:}:\n{:}".format(
+            self.name, self.process.returncode, output
+        ))
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def measure(processes, seconds):
+    """
+    Wait for every process to finish its second metrics window and return each one's
+    (baseline, measured) windows.
+    """
+    give_up_at = time.monotonic() + STARTUP_TIMEOUT + 2 * seconds
+    while True:
+        windows = [process.windows() for process in processes]
+        if all(len(dumped) >= 2 for dumped in windows):
+            return [dumped[:2] for dumped in windows]
+        for process in processes:
+            process.check()
+        if time.monotonic() > give_up_at:
+            raise Exception("Timed out waiting for metrics from {:}".format(
+                ', '.join(process.name for process in processes)
+            ))
+        time.sleep(0.1)
+
+
+def rates(windows):
+    """
+    The measured window's duration and how much each counter grew over it.
+    """
+    baseline, measured = windows
+    deltas = {
+        name: value - baseline['counters'].get(name, 0)
+        for name, value in measured['counters'].items()
+    }
+    return measured['time'] - baseline['time'], deltas
+
+
+def per(amount, count, scale=1.0):
+    return amount / count * scale if count else None
+
+
+def latency_summary(spans, name):
+    values = spans.get(name)
+    if values is None:
+        return None
+    return {field: values[field] for field in ('count', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')}
+
+
+def start_relay(work_dir, port, impairments, processes, seconds):
+    """
+    Start udp_relay.py in front of the server on `port`, if there are `impairments`. Returns
+    the port clients should use.
+    """
+    if not impairments:
+        return port
+    relay_port = free_port()
+    relay = BenchProcess(
+        work_dir, 'udp_relay.py', ['127.0.0.1', relay_port, '127.0.0.1', port, impairments],
+        seconds
+    )
+    processes.append(relay)
+    wait_for_bind(relay_port, relay)
+    return relay_port
+
+
+def run_video(work_dir, codec, chunk_size, seconds, impairments=None):
+    work_dir = tempfile.mkdtemp(dir=work_dir)
+    port, client_port = free_port(), free_port()
+    server = BenchProcess(work_dir, 'video_server.py', ['127.0.0.1', port, codec], seconds)
+    processes = [server]
+    try:
+        wait_for_bind(port, server)
+        port = start_relay(work_dir, port, impairments, processes, seconds)
+        client = BenchProcess(
+            work_dir, 'video_client.py', ['127.0.0.1', port, client_port, chunk_size], seconds
+        )
+        processes.append(client)
+        server_windows, client_windows = measure([server, client], seconds)
+    finally:
+        for process in processes:
+            process.stop()
+
+    server_time, sent = rates(server_windows)
+    client_time, received = rates(client_windows)
+    client_spans = client_windows[1]['spans']
+    return {
+        'codec': codec,
+        'chunk_size': chunk_size,
+        'fps': received['frames_received'] / client_time,
+        'mb_per_s': received['bytes_received'] / client_time / 1e6,
+        'frames_sent_per_s': sent['frames_sent'] / server_time,
+        'frames_skipped_per_s': sent['frames_skipped'] / server_time,
+        'frames_dropped_per_s': received['frames_dropped'] / client_time,
+        'chunks_sent_per_s': sent['chunks_sent'] / server_time,
+        'chunks_received_per_s': received['chunks_received'] / client_time,
+        'server_cpu_ms_per_frame': per(sent['cpu_time'], sent['frames_sent'], 1000),
+        'client_cpu_ms_per_frame': per(received['cpu_time'], received['frames_received'], 1000),
+        'glass_to_glass': latency_summary(client_spans, 'glass_to_glass'),
+        # Where the 'adaptive' codec had settled by the end, see bitrate.py
+        'bitrate_level': server_windows[1]['counters'].get('bitrate_level'),
+        'server_spans': server_windows[1]['spans'],
+        'client_spans': client_spans,
+    }
+
+
+def run_control(work_dir, seconds, impairments=None):
+    work_dir = tempfile.mkdtemp(dir=work_dir)
+    port = free_port()
+    server = BenchProcess(work_dir, 'car_controller_server.py', ['127.0.0.1', port], seconds)
+    processes = [server]
+    try:
+        wait_for_bind(port, server)
+        port = start_relay(work_dir, port, impairments, processes, seconds)
+        client = BenchProcess(
+            work_dir, 'car_controller_client.py', ['127.0.0.1', port, 'sweep'], seconds
+        )
+        processes.append(client)
+        server_windows, client_windows = measure([server, client], seconds)
+    finally:
+        for process in processes:
+            process.stop()
+
+    server_time, accepted = rates(server_windows)
+    client_time, sent = rates(client_windows)
+    server_spans = server_windows[1]['spans']
+    return {
+        'commands_sent_per_s': sent['commands_sent'] / client_time,
+        'commands_accepted_per_s': accepted['commands_accepted'] / server_time,
+        'commands_discarded_per_s': accepted['commands_discarded'] / server_time,
+        'server_cpu_percent': 100 * accepted['cpu_time'] / server_time,
+        'client_cpu_percent': 100 * sent['cpu_time'] / client_time,
+        'input_to_actuation': latency_summary(server_spans, 'input_to_actuation'),
+        'server_spans': server_spans,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_ms(summary):
+    if summary is None:
+        return '     -      -      -'
+    return '{p50_ms:6.2f} {p95_ms:6.2f} {p99_ms:6.2f}'.format(**summary)
+
+
+def main():
+    if len(sys.argv) not in (2, 3, 4, 5, 6):
+        print(
+            "Usage: {:} <output JSON> [<seconds per run> [<codecs> [<chunk sizes> "
+            "[<impairments>]]]]".format(sys.argv[0])
+        )
+        sys.exit(1)
+    output_path = sys.argv[1]
+    seconds = float(sys.argv[2]) if len(sys.argv) >= 3 else DEFAULT_SECONDS
+    codecs = sys.argv[3].split(',') if len(sys.argv) >= 4 else DEFAULT_CODECS
+    chunk_sizes = [int(size) for size in sys.argv[4].split(',')] if len(sys.argv) >= 5 \
+        else DEFAULT_CHUNK_SIZES
+    impairments = sys.argv[5] if len(sys.argv) == 6 else None
+
+    results = {
+        'time': time.time(),
+        'commit': git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'seconds': seconds,
+        'impairments': impairments,
+        'video': [],
+    }
+
+    work_dir = tempfile.mkdtemp(prefix='rpicar-bench-')
+    try:
+        print('codec      chunk     fps    MB/s  pkts/s  drop/s  cpu ms/frame  '
+              'glass to glass p50/95/99 ms')
+        for codec in codecs:
+            for chunk_size in chunk_sizes:
+                run = run_video(work_dir, codec, chunk_size, seconds, impairments)
+                results['video'].append(run)
+                print('{:8} {:7d} {:7.1f} {:7.1f} {:7.0f} {:7.1f}  {:5.2f} {:5.2f}  {:}'.format(
+                    codec, chunk_size, run['fps'], run['mb_per_s'], run['chunks_received_per_s'],
+                    run['frames_dropped_per_s'], run['server_cpu_ms_per_frame'] or 0,
+                    run['client_cpu_ms_per_frame'] or 0, format_ms(run['glass_to_glass'])
+                ))
+
+        results['control'] = run = run_control(work_dir, seconds, impairments)
+        print()
+        print('control: {:.1f} commands/s sent, {:.1f}/s accepted, cpu {:.1f}% / {:.1f}%, '
+              'input to actuation p50/95/99 ms {:}'.format(
+                  run['commands_sent_per_s'], run['commands_accepted_per_s'],
+                  run['server_cpu_percent'], run['client_cpu_percent'],
+                  format_ms(run['input_to_actuation'])
+              ))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to {:}'.format(output_path))
+
+
+if __name__ == '__main__':
+    main()
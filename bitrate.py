@@ -0,0 +1,159 @@
+"""
+Adapting the video stream to what the link can carry, from the client's FEEDBACK reports.
+
+The stream runs at one of a ladder of operating points, each a JPEG quality, a factor to
+shrink the frame by on each side and a frame rate, best first. Every report is judged on the
+frames it covers:
+
+    loss  the fraction of frames dropped
+    late  the fraction of received frames that were slow to reassemble
+    load  the mean reassembly time as a fraction of the frame interval, i.e. how much of the
+          time the link is busy delivering frames
+
+A report with any of these over its BAD_ limit steps the stream down a point straight away,
+unless it was only just changed, as the reports lag behind. It only steps back up after
+STEP_UP_AFTER reports in a row with everything under the much lower GOOD_ limits, so it
+doesn't flap between two points. Hearing nothing from the client for STALL_TIMEOUT counts as
+a bad report too, so a stream that has stalled completely keeps stepping down until it gets
+through.
+
+Give the servers 'adaptive' as their codec to use this.
+"""
+from collections import namedtuple
+
+from video_codecs import JpegCodec
+
+ADAPTIVE_CODEC = 'adaptive'
+
+OperatingPoint = namedtuple('OperatingPoint', ['quality', 'scale', 'fps'])
+
+# Best first. The frame's width and height are divided by `scale`.
+OPERATING_POINTS = (
+    OperatingPoint(85, 1, 30),
+    OperatingPoint(75, 1, 30),
+    OperatingPoint(60, 1, 30),
+    OperatingPoint(50, 2, 30),
+    OperatingPoint(40, 2, 20),
+    OperatingPoint(30, 2, 15),
+    OperatingPoint(30, 4, 10),
+    OperatingPoint(20, 4, 5),
+)
+START_LEVEL = 2
+
+BAD_LOSS, GOOD_LOSS = 0.10, 0.02
+BAD_LATE, GOOD_LATE = 0.10, 0.02
+BAD_LOAD, GOOD_LOAD = 0.8, 0.4
+
+STEP_UP_AFTER = 6         # good reports in a row, 3 s at the usual feedback interval
+STEP_DOWN_HOLD = 1.0      # seconds after a change before stepping down again
+STALL_TIMEOUT = 2.0       # seconds
+
+
+def counter_delta(new, old):
+    """
+    How much a FEEDBACK counter grew, allowing for it wrapping around at 2**32.
+    """
+    return (new - old) & 0xFFFFFFFF
+
+
+class BitrateController:
+    """
+    Picks the operating point from `points` (best first), starting at `level`.
+
+    Pass each new Feedback to update() as it arrives, and call update() with None regularly
+    in between so a stall is noticed. `codec` is the codec for the current point. `loss`,
+    `late` and `load` are from the last report, None before the first.
+    """
+    def __init__(self, points=OPERATING_POINTS, level=START_LEVEL):
+        self.points = points
+        self.level = level
+        self.codecs = {}
+        self.last_feedback = None
+        self.last_report_time = None
+        self.last_change = None
+        self.good_reports = 0
+        self.loss = None
+        self.late = None
+        self.load = None
+
+    @property
+    def point(self):
+        return self.points[self.level]
+
+    @property
+    def codec(self):
+        quality = self.point.quality
+        codec = self.codecs.get(quality)
+        if codec is None:
+            codec = self.codecs[quality] = JpegCodec(quality)
+        return codec
+
+    def describe(self):
+        point = self.point
+        return 'q{:} 1/{:} {:}fps'.format(point.quality, point.scale, point.fps)
+
+    def _step(self, step, now):
+        level = max(0, min(len(self.points) - 1, self.level + step))
+        self.good_reports = 0
+        if level == self.level:
+            return False
+        self.level = level
+        self.last_change = now
+        return True
+
+    def _judge(self, feedback):
+        """
+        Work out the loss, late and load of the frames since the last report. Returns -1 for
+        a bad report, 1 for a good one and 0 for one in between.
+        """
+        last = self.last_feedback
+        received = counter_delta(feedback.frames_received, last.frames_received)
+        dropped = counter_delta(feedback.frames_dropped, last.frames_dropped)
+        if not received:
+            self.loss = 1.0 if dropped else None
+            return -1
+        late = counter_delta(feedback.frames_late, last.frames_late)
+        assembly_time = counter_delta(feedback.assembly_time_us, last.assembly_time_us) / 1e6
+
+        self.loss = dropped / (received + dropped)
+        self.late = late / received
+        self.load = assembly_time / received * self.point.fps
+
+        if self.loss > BAD_LOSS or self.late > BAD_LATE or self.load > BAD_LOAD:
+            return -1
+        if self.loss < GOOD_LOSS and self.late < GOOD_LATE and self.load < GOOD_LOAD:
+            return 1
+        return 0
+
+    def update(self, feedback, now):
+        """
+        Take in the client's latest Feedback, or None if nothing new has arrived. `now` is a
+        time.monotonic() value. Returns whether the operating point changed.
+        """
+        if self.last_change is None:
+            self.last_change = now
+        if feedback is None or feedback == self.last_feedback:
+            # Nothing heard from the client for a while, the stream may have stalled
+            since = now - (self.last_report_time or self.last_change)
+            if since > STALL_TIMEOUT and now - self.last_change > STALL_TIMEOUT:
+                return self._step(1, now)
+            return False
+
+        self.last_report_time = now
+        if self.last_feedback is None:
+            self.last_feedback = feedback
+            return False
+        verdict = self._judge(feedback)
+        self.last_feedback = feedback
+
+        if verdict < 0:
+            if now - self.last_change >= STEP_DOWN_HOLD:
+                return self._step(1, now)
+            self.good_reports = 0
+        elif verdict > 0:
+            self.good_reports += 1
+            if self.good_reports >= STEP_UP_AFTER:
+                return self._step(-1, now)
+        else:
+            self.good_reports = 0
+        return False
@@ -0,0 +1,167 @@
+"""
+Per-car calibration of the steering and throttle outputs.
+
+Each channel maps an input in [-1, 1] to PWM ticks through a lookup table, built once with
+NumPy when the calibration is loaded, so the control loop only does an index calculation and
+a list lookup per update.
+
+A calibration file is JSON with optional "steering" and "throttle" objects, each of which may
+set any of:
+
+    min, max     PWM ticks at inputs of -1 and +1
+    center       PWM ticks at an input of 0, defaults to halfway between min and max
+    trim         ticks added to every output (the result is still kept within min and max)
+    deadband     inputs closer to 0 than this give 0, either one number or a
+                 [negative side, positive side] pair; the rest of the range is rescaled to fill
+                 [-1, 1]
+    expo         0 for a linear response up to 1 for a fully cubic one, softening the centre
+    curve        a list of [input, output] points, in increasing input order, for any other
+                 response shape, applied after the expo by linear interpolation
+    invert       true to swap the directions
+
+Channels or settings that aren't given use the defaults in car_control.py, which give the
+same linear mapping as get_steering_pwm() and get_throttle_pwm() to within one tick. The
+table rounds the input to the nearest 1/512 first, so an input near the boundary between two
+ticks can come out one tick different.
+"""
+import json
+import os
+
+import numpy as np
+
+from car_control import MAX_STEERING, MAX_THROTTLE, MIN_STEERING, MIN_THROTTLE
+
+# Odd, so an input of exactly 0 has its own entry
+LUT_SIZE = 1025
+
+
+class ChannelCalibration:
+    """
+    Maps inputs in [-1, 1] to PWM ticks for one channel. Call it with the input.
+    """
+    def __init__(self, min, max, center=None, trim=0, deadband=0.0, expo=0.0, curve=None,
+                 invert=False, size=LUT_SIZE):
+        if center is None:
+            center = (min + max) / 2
+        if isinstance(deadband, (int, float)):
+            deadband = (deadband, deadband)
+        negative_deadband, positive_deadband = deadband
+        if not (0 <= negative_deadband < 1 and 0 <= positive_deadband < 1):
+            raise ValueError("Deadbands must be in [0, 1), got {:}".format(deadband))
+
+        x = np.linspace(-1.0, 1.0, size)
+        y = np.where(
+            x > positive_deadband,
+            (x - positive_deadband) / (1 - positive_deadband),
+            np.where(x < -negative_deadband, (x + negative_deadband) / (1 - negative_deadband), 0.0)
+        )
+        y = (1 - expo) * y + expo * y ** 3
+        if curve:
+            curve_in, curve_out = np.array(curve, dtype=float).T
+            y = np.interp(y, curve_in, curve_out)
+        if invert:
+            y = -y
+
+        ticks = np.where(y >= 0, center + y * (max - center), center + y * (center - min)) + trim
+        ticks = np.clip(ticks, np.minimum(min, max), np.maximum(min, max))
+
+        # A list rather than an array, indexing it is much quicker for single values
+        self.table = (ticks + 0.5).astype(int).tolist()
+        self.half_span = (size - 1) / 2
+
+    def __call__(self, value):
+        ndx = int((value + 1.0) * self.half_span + 0.5)
+        if ndx < 0:
+            ndx = 0
+        elif ndx >= len(self.table):
+            ndx = len(self.table) - 1
+        return self.table[ndx]
+
+
+class Calibration:
+    """
+    Steering and throttle calibrations, by default car_control's linear mapping to within a tick.
+    """
+    def __init__(self, steering=None, throttle=None):
+        self.steering = ChannelCalibration(
+            **dict({'min': MIN_STEERING, 'max': MAX_STEERING}, **(steering or {}))
+        )
+        self.throttle = ChannelCalibration(
+            **dict({'min': MIN_THROTTLE, 'max': MAX_THROTTLE}, **(throttle or {}))
+        )
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            settings = json.load(f)
+        if not isinstance(settings, dict):
+            raise ValueError("A calibration file must hold a JSON object")
+        for channel in ('steering', 'throttle'):
+            if not isinstance(settings.get(channel, {}), dict):
+                raise ValueError("The {:} calibration must be a JSON object".format(channel))
+        return cls(settings.get('steering'), settings.get('throttle'))
+
+    def refresh(self, now):
+        """
+        Fixed calibrations never change. See CalibrationFile.
+        """
+        return False
+
+
+class CalibrationFile:
+    """
+    A Calibration loaded from `path` that reloads itself when the file changes, so the car can
+    be recalibrated while it's running.
+
+    refresh() checks the file's modification time at most every `check_interval` seconds. If
+    the new file can't be loaded, for whatever reason, the previous calibration is kept rather
+    than the error stopping the outputs mid-drive.
+    """
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.mtime = os.stat(path).st_mtime
+        self.calibration = Calibration.load(path)
+        self.last_check = None
+
+    @property
+    def steering(self):
+        return self.calibration.steering
+
+    @property
+    def throttle(self):
+        return self.calibration.throttle
+
+    def refresh(self, now):
+        """
+        Reload the file if it has changed. `now` is a time.monotonic() value. Returns whether
+        the calibration was reloaded.
+        """
+        if self.last_check is not None and now - self.last_check < self.check_interval:
+            return False
+        self.last_check = now
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self.mtime:
+                return False
+            self.mtime = mtime
+            self.calibration = Calibration.load(self.path)
+        except Exception as e:  # pylint: disable=broad-except
+            print("\nCouldn't reload calibration from {:}: {:}".format(self.path, e))
+            return False
+
+        print("\nReloaded calibration from {:}".format(self.path))
+        return True
+
+
+def open_calibration(path=None):
+    """
+    The calibration from `path`, by default the file named by the RPICAR_CALIBRATION
+    environment variable. Without either the car_control defaults are used.
+    """
+    if path is None:
+        path = os.environ.get('RPICAR_CALIBRATION')
+    if not path:
+        return Calibration()
+    return CalibrationFile(path)
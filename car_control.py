@@ -0,0 +1,256 @@
+"""
+Shared settings and helpers for driving the car's steering servo and throttle ESC through
+the PCA9685 PWM driver, and for the control packets the driver station sends to the car.
+
+Control packets are control_protocol messages. The car acts on the MSG_AXES ones, which carry
+the steering and throttle inputs. The driver station also sends clock sync requests (see
+clock_sync.py) over the same socket, so the car can tell how old each command is.
+"""
+import time
+
+from clock_sync import CLOCK_REQUEST, ClockSync, answer_clock_request, recv_timestamped
+from control_protocol import AxesMessage, MAX_MESSAGE_SIZE, pack_axes, unpack_message
+
+THROTTLE_CHANNEL = 0
+STEERING_CHANNEL = 1
+PWM_FREQUENCY = 60
+
+MIN_STEERING, MAX_STEERING = 300, 450   # Right to left
+MIN_THROTTLE, MAX_THROTTLE = 330, 400   # Reverse to front
+
+# How fast the outputs may move towards a new target, in PWM ticks per second. Lock to lock
+# steering takes 0.15 s and full reverse to full forward throttle 0.3 s.
+STEERING_SLEW_RATE = (MAX_STEERING - MIN_STEERING) / 0.15
+THROTTLE_SLEW_RATE = (MAX_THROTTLE - MIN_THROTTLE) / 0.3
+
+# Default rate of the actuation loop, independent of how often control packets arrive
+ACTUATION_RATE = 50
+
+
+def get_steering_pwm(value):
+    """
+    Convert value [-1, 1] to the range [MIN_STEERING, MAX_STEERING]
+    """
+    return int(MIN_STEERING + (1 + (+1 * value)) * 0.5 * (MAX_STEERING - MIN_STEERING) + 0.5)
+
+
+def get_throttle_pwm(value):
+    """
+    Convert value [-1, 1] to the range [MIN_THROTTLE, MAX_THROTTLE]
+    """
+    return int(MIN_THROTTLE + (1 + value) * 0.5 * (MAX_THROTTLE - MIN_THROTTLE) + 0.5)
+
+
+class SlewLimiter:
+    """
+    Moves a value towards its target by at most `rate` units per second.
+    """
+    def __init__(self, rate, value):
+        self.rate = rate
+        self.value = value
+        self.target = value
+
+    def update(self, dt):
+        step = self.rate * dt
+        self.value = min(self.target, self.value + step) if self.target > self.value \
+            else max(self.target, self.value - step)
+        return self.value
+
+
+class Actuator:
+    """
+    Drives the steering and throttle channels of `pwm` (a pwm_output.PwmOutput) towards the
+    latest targets, slew-rate limited so the outputs move smoothly between control packets.
+
+    Inputs are turned into PWM values by `calibration` (a calibration.Calibration or
+    CalibrationFile), and retargeted whenever a CalibrationFile reloads.
+
+    Call set_targets() whenever a command arrives and update() at the actuation rate.
+    """
+    def __init__(self, pwm, calibration, steering_rate=STEERING_SLEW_RATE,
+                 throttle_rate=THROTTLE_SLEW_RATE):
+        self.pwm = pwm
+        self.calibration = calibration
+        self.inputs = (0.0, 0.0)
+        self.steering = SlewLimiter(steering_rate, calibration.steering(0.0))
+        self.throttle = SlewLimiter(throttle_rate, calibration.throttle(0.0))
+        self.last_update = None
+
+    def set_targets(self, steering, throttle):
+        """
+        Aim for the given steering and throttle inputs, each in [-1, 1].
+        """
+        self.inputs = (steering, throttle)
+        self.steering.target = self.calibration.steering(steering)
+        self.throttle.target = self.calibration.throttle(throttle)
+
+    def update(self, now):
+        """
+        Step the outputs towards their targets and write them. `now` is a time.monotonic()
+        value. Returns the (steering, throttle) PWM values written.
+        """
+        if self.calibration.refresh(now):
+            self.set_targets(*self.inputs)
+
+        dt = 0.0 if self.last_update is None else now - self.last_update
+        self.last_update = now
+
+        steering_pwm = int(round(self.steering.update(dt)))
+        throttle_pwm = int(round(self.throttle.update(dt)))
+        self.pwm.set(THROTTLE_CHANNEL, throttle_pwm, now)
+        self.pwm.set(STEERING_CHANNEL, steering_pwm, now)
+        return steering_pwm, throttle_pwm
+
+
+ControlCommand = AxesMessage
+
+# Big enough for any control message or clock sync request, with a byte to spare so oversized
+# datagrams show up as the wrong size rather than being truncated to the right one
+MAX_DATAGRAM_SIZE = max(MAX_MESSAGE_SIZE, CLOCK_REQUEST.size) + 1
+
+
+# A control input has to move by this much to be sent straight away
+CONTROL_CHANGE_THRESHOLD = 0.02
+# While the inputs are steady the last command is repeated this often, in case it was lost
+HEARTBEAT_INTERVAL = 0.25
+
+
+class ControlSender:
+    """
+    Sends control packets to the car as soon as the inputs change noticeably, and otherwise
+    only as a heartbeat every `heartbeat_interval` seconds.
+
+    Any change that lands on centre or full lock is always sent, however small, so the car
+    never ends up stuck just short of it.
+
+    A clock sync request goes out every `clock.interval` seconds too, so `sock` must be
+    non-blocking for the replies to be drained on each update.
+    """
+    def __init__(self, sock, addr, threshold=CONTROL_CHANGE_THRESHOLD,
+                 heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.sock = sock
+        self.addr = addr
+        self.threshold = threshold
+        self.heartbeat_interval = heartbeat_interval
+        self.seq = 0
+        self.last_sent = None
+        self.last_send_time = None
+        self.clock = ClockSync()
+
+    def _significant(self, old, new):
+        return abs(new - old) >= self.threshold or (new != old and new in (-1.0, 0.0, 1.0))
+
+    def next_send(self):
+        """
+        The time.monotonic() time by which the next heartbeat or clock sync request is due.
+        """
+        if self.last_send_time is None or self.clock.last_request is None:
+            return time.monotonic()
+        return min(
+            self.last_send_time + self.heartbeat_interval,
+            self.clock.last_request + self.clock.interval
+        )
+
+    def update(self, steering, throttle, now=None):
+        """
+        Send the inputs if they've changed enough or a heartbeat is due. Returns whether a
+        packet was sent.
+        """
+        if now is None:
+            now = time.monotonic()
+        self.clock.drain(self.sock)
+        if self.clock.due(now):
+            self.sock.sendto(self.clock.request(now), self.addr)
+
+        if self.last_sent is not None and \
+                now < self.last_send_time + self.heartbeat_interval and not (
+            self._significant(self.last_sent[0], steering) or
+            self._significant(self.last_sent[1], throttle)
+        ):
+            return False
+
+        self.sock.sendto(pack_axes(self.seq, time.time(), steering, throttle), self.addr)
+        self.seq += 1
+        self.last_sent = (steering, throttle)
+        self.last_send_time = now
+        return True
+
+
+class ControlReceiver:
+    """
+    Tracks the newest control packet from the client, discarding any that arrive out of order.
+    Packets are ordered by sequence number alone, so a step back in the client's wall clock
+    (e.g. an NTP correction) doesn't get its new commands discarded.
+
+    The timestamps are only used to spot a restarted client. A packet whose sequence number
+    goes backwards but whose timestamp is newer can only come from one, so it starts a new session rather than being discarded. That way
+    losing the client's hiya doesn't leave the car ignoring it. `resyncs` counts these.
+
+    `clock_offset` is the client's latest estimate of our clock minus theirs, from its clock
+    sync requests, or None before it has one.
+    """
+    def __init__(self):
+        self.reset()
+        self.accepted = 0
+        self.discarded = 0
+        self.resyncs = 0
+
+    def reset(self):
+        self.seq = None
+        self.timestamp = None
+        self.clock_offset = None
+
+    def answer_clock(self, msg, received_at):
+        """
+        The reply to send if `msg` is a clock sync request that arrived at `received_at`,
+        else None.
+        """
+        answer = answer_clock_request(msg, received_at)
+        if answer is None:
+            return None
+        reply, client_offset = answer
+        if client_offset is not None:
+            self.clock_offset = client_offset
+        return reply
+
+    def accept(self, msg):
+        """
+        The ControlCommand in `msg` if it's newer than everything accepted so far, else None.
+        """
+        command = unpack_message(msg)
+        if not isinstance(command, ControlCommand):
+            return None
+        if self.seq is not None:
+            seq_delta = ((command.seq - self.seq + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            if seq_delta <= 0 and command.timestamp > self.timestamp:
+                # A new session, the client restarted and its hiya went missing
+                self.reset()
+                self.resyncs += 1
+            elif seq_delta <= 0:
+                self.discarded += 1
+                return None
+        self.seq = command.seq
+        self.timestamp = command.timestamp
+        self.accepted += 1
+        return command
+
+    def drain(self, sock):
+        """
+        Read every datagram waiting on the non-blocking `sock` and return the newest command,
+        or None if there wasn't one. Everything older is dropped, so the car always acts on the
+        latest input rather than working through a backlog. Clock sync requests are answered.
+        """
+        newest = None
+        while True:
+            try:
+                msg, addr, received_at = recv_timestamped(sock, MAX_DATAGRAM_SIZE)
+            except BlockingIOError:
+                return newest
+            if msg == b'hiya':
+                self.reset()
+                continue
+            reply = self.answer_clock(msg, received_at)
+            if reply is not None:
+                sock.sendto(reply, addr)
+                continue
+            newest = self.accept(msg) or newest
@@ -1,87 +1,53 @@
 """
 A simple script to connect a remote car and send controller inputs.
+
+Inputs are sent as soon as they change, with a heartbeat while they're steady. They come from
+the keyboard or a joystick through pygame by default, or with the 'gamepad' input backend
+straight from a gamepad, which doesn't need a display (see control_input.py).
 """
-# pylint: disable=E1101
-import numpy as np
-import sys, time, os
-import pygame
+import sys, time
 import socket
-import struct
+
+from car_control import ControlSender
+from clock_sync import enable_timestamps
+from control_input import open_input
+from metrics import open_metrics
 
 
-if len(sys.argv) != 3:
-    print("Usage: {:} <host> <port>".format(sys.argv[0]))
+if len(sys.argv) not in (3, 4):
+    print("Usage: {:} <host> <port> [<input backend>]".format(sys.argv[0]))
     sys.exit(1)
 host = sys.argv[1]
 port = int(sys.argv[2])
 server_addr = (host, port)
+input_backend = sys.argv[3] if len(sys.argv) == 4 else 'pygame'
 
-pygame.init() 
-
-# Set parameters and constants
-size = width, height = 200, 100
-FPS = 10
-WHITE = (255, 255, 255)
-BLACK = (0, 0, 0)
-DEADZONE = 0.15
-
-if pygame.joystick.get_count() > 0:
-    joystick = pygame.joystick.Joystick(0)
-    joystick.init()
-    pygame.joystick.init()
-    use_joystick = True
-else:
-    use_joystick = False
-
-screen = pygame.display.set_mode(size)
-pygame.display.set_caption("RPiCar Client")
+controls = open_input(input_backend)
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.sendto(b'hiya', server_addr)
+# Clock sync replies are picked up between sends
+sock.setblocking(False)
+enable_timestamps(sock)
 
 print('Connected to server')
 print('Starting control loop')
 
-while True:
-    t0 = time.time()
+sender = ControlSender(sock, server_addr)
+# Packet counts, dumped to the file named by RPICAR_METRICS if it's set
+metrics = open_metrics()
 
-    # Event loop    
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:  
-            sys.exit()
+while not controls.quit:
+    # Sleep until there's input or the next heartbeat or clock sync is due
+    left_right, front_back = controls.wait(sender.next_send() - time.monotonic())
 
-    screen.fill(WHITE)
+    sent = sender.update(left_right, front_back)
+    metrics.set_counter('commands_sent', sender.seq)
+    metrics.tick()
 
-    if use_joystick:
-        left_right = joystick.get_axis(0)
-        front_back = -1.0 * joystick.get_axis(2)
-    else:
-        left_right = (
-            pygame.key.get_pressed()[pygame.K_a] * -1.0 + 
-            pygame.key.get_pressed()[pygame.K_d] * 1.0
-        )
-        front_back = (
-            pygame.key.get_pressed()[pygame.K_DOWN] * -1.0 + 
-            pygame.key.get_pressed()[pygame.K_UP] * 1.0
+    if sent:
+        print('\r', end='')
+        print(
+            'Front/Back: {:.2f}    -    Left/Right: {:.2f}    '.format(front_back, left_right), 
+            end=''
         )
-    
-    if abs(left_right) < DEADZONE:
-        left_right = 0.0
-
-    print('\r', end='')
-    print(
-        'Front/Back: {:.2f}    -    Left/Right: {:.2f}    '.format(front_back, left_right), 
-        end=''
-    )
-
-    joy_input = struct.pack('>f', left_right) + struct.pack('>f', front_back)
-
-    sock.sendto(joy_input, server_addr)
-
-    pygame.display.flip()
-
-    # Cap the FPS
-    elapsed_time = time.time() - t0
-
-    if ((1 / FPS) - elapsed_time) > 0:
-        time.sleep((1 / FPS) - elapsed_time)
@@ -1,88 +1,97 @@
 """
 A simple control loop that receives steering and throttle inputs from a remote machine
 via UDP and uses the signals to control a car via the PCA968 interface.
+
+Set RPICAR_PWM_BACKEND=sim to run without the PWM board, and RPICAR_CALIBRATION to the
+path of a calibration file (see calibration.py) to use the car's own calibration.
 """
 # pylint: disable=E1101
 import numpy as np
 import sys, time
 # import pygame
 import socket
-import struct
-import Adafruit_PCA9685
+
+from calibration import open_calibration
+from car_control import ACTUATION_RATE, MAX_DATAGRAM_SIZE, Actuator, ControlReceiver
+from clock_sync import enable_timestamps, latency
+from control_protocol import unpack_message
+from metrics import open_metrics
+from pwm_output import open_pwm
 
 
-if len(sys.argv) != 3:
-    print("Usage: {:} <host> <port>".format(sys.argv[0]))
+if len(sys.argv) not in (3, 4):
+    print("Usage: {:} <host> <port> [<actuation rate (Hz)>]".format(sys.argv[0]))
     sys.exit(1)
 host = sys.argv[1]
 port = int(sys.argv[2])
 server_addr = (host, port)
+# The outputs are updated at this rate whatever rate control packets come in at
+FPS = float(sys.argv[3]) if len(sys.argv) == 4 else ACTUATION_RATE
 
 # pygame.init()  
 
 # Set parameters and constants
 # size = width, height = 960, 480
 # imsize = imwidth, imheight = 640, 480
-FPS = 10
 # WHITE = (255, 255, 255)
 # BLACK = (0, 0, 0)
 
-MIN_STEERING, MAX_STEERING = 300, 450   # Right to left
-MIN_THROTTLE, MAX_THROTTLE = 330, 400   # Reverse to front
-
-
-def get_steering_pwm(value):
-    """
-    Convert value [-1, 1] to the range [MIN_STEERING, MAX_STEERING]
-    """
-    return int(MIN_STEERING + (1 + (+1 * value)) * 0.5 * (MAX_STEERING - MIN_STEERING) + 0.5)
-
-
-def get_throttle_pwm(value):
-    """
-    Convert value [-1, 1] to the range [MIN_STEERING, MAX_STEERING]
-    """
-    return int(MIN_THROTTLE + (1 + value) * 0.5 * (MAX_THROTTLE - MIN_THROTTLE) + 0.5)
-
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind(server_addr)
+enable_timestamps(sock)
 
 print("Waiting for client connection...")
 
-msg, addr = sock.recvfrom(4)
-
-if msg != b'hiya':
-    raise Exception("Something went wrong!")
+# The client says hiya first, but if that's lost its first command will do
+while True:
+    msg, addr = sock.recvfrom(MAX_DATAGRAM_SIZE)
+    if msg == b'hiya' or unpack_message(msg) is not None:
+        break
 
 print("Connected with {:}:{:}".format(addr[0], addr[1]))
+
+# Loop timings and how long after the input was read each command reached the outputs,
+# dumped to the file named by RPICAR_METRICS if it's set
+metrics = open_metrics()
+
+# Set up the PWM driver once, it only gets written to when a value changes
+pwm = open_pwm(metrics=metrics)
+
 print("Starting control loop")
 
+sock.setblocking(False)
+receiver = ControlReceiver()
+actuator = Actuator(pwm, open_calibration())
+
 while True:
     t0 = time.time()
 
-    # Receive two float32s from the client, one per axis of control (steering then throttle)
-    msg, addr = sock.recvfrom(8)
-    if not msg:
-        break
-    left_right = struct.unpack('>f', msg[:4])[0]
-    front_back = struct.unpack('>f', msg[4:])[0]
-
-    left_right_pwm = get_steering_pwm(left_right)
-    front_back_pwm = get_throttle_pwm(front_back)
-
-    print('\r', end='')
-    print(
-        'Front/Back: {:.2f} ({:>3})   -    Left/Right: {:.2f}  ({:>3})  '.format(
-            front_back, front_back_pwm, left_right, left_right_pwm
-        ), 
-        end=''
-    )
-
-    pwm = Adafruit_PCA9685.PCA9685()
-    pwm.set_pwm_freq(60)
-    pwm.set_pwm(0, 0, front_back_pwm)
-    pwm.set_pwm(1, 0, left_right_pwm)
+    # Aim for only the newest of whatever control packets arrived since the last tick
+    with metrics.span('receive'):
+        command = receiver.drain(sock)
+    if command is not None:
+        actuator.set_targets(command.steering, command.throttle)
+
+    # Move the outputs smoothly towards the targets
+    with metrics.span('actuate'):
+        left_right_pwm, front_back_pwm = actuator.update(time.monotonic())
+    if command is not None:
+        metrics.add_latency(
+            'input_to_actuation', latency(command.timestamp, receiver.clock_offset)
+        )
+    metrics.set_counter('commands_accepted', receiver.accepted)
+    metrics.set_counter('commands_discarded', receiver.discarded)
+    metrics.tick()
+
+    if command is not None:
+        print('\r', end='')
+        print(
+            'Front/Back: {:.2f} ({:>3})   -    Left/Right: {:.2f}  ({:>3})  '.format(
+                command.throttle, front_back_pwm, command.steering, left_right_pwm
+            ), 
+            end=''
+        )
 
     # Cap the FPS
     elapsed_time = time.time() - t0
@@ -0,0 +1,250 @@
+"""
+Runs the car's control and video channels in one process, on a single asyncio event loop.
+
+Control datagrams are handled the moment they arrive, while video frames are encoded on a
+worker thread and sent a slice of chunks at a time, yielding to the event loop in between.
+That way control latency never depends on how much video is being sent. Video goes out
+through the endpoint's transport, which buffers what the socket can't take yet and pauses
+the stream until its buffer drains.
+
+The control channel speaks the same protocol as car_controller_server.py and the video channel
+the same one as video_server.py, so car_controller_client.py and video_client.py connect to it
+unchanged. Set RPICAR_PWM_BACKEND=sim to run without the PWM board, and RPICAR_CALIBRATION
+to the path of a calibration file (see calibration.py) to use the car's own calibration.
+
+Both channels answer clock sync requests (see clock_sync.py), and how long after the input was
+read each command reached the outputs is recorded as 'input_to_actuation' in the metrics.
+"""
+# pylint: disable=E1101
+import asyncio
+import socket
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from calibration import open_calibration
+from bitrate import ADAPTIVE_CODEC, BitrateController
+from car_control import ACTUATION_RATE, Actuator, ControlReceiver
+from clock_sync import answer_clock_request, latency
+from frame_source import CheckerboardSource
+from metrics import open_metrics
+from pwm_output import open_pwm
+from video_codecs import make_codec
+from video_protocol import Packetizer, answer_hello, is_hello, parse_feedback
+
+
+if len(sys.argv) not in (4, 5, 6):
+    print(
+        "Usage: {:} <host> <control port> <video port> [<codec> [<actuation rate (Hz)>]]".format(
+            sys.argv[0]
+        )
+    )
+    sys.exit(1)
+host = sys.argv[1]
+control_port = int(sys.argv[2])
+video_port = int(sys.argv[3])
+codec_spec = sys.argv[4] if len(sys.argv) >= 5 else 'jpeg'
+# 'adaptive' fits the stream to the link, see bitrate.py
+adaptive = codec_spec == ADAPTIVE_CODEC
+codec = None if adaptive else make_codec(codec_spec)
+actuation_rate = float(sys.argv[5]) if len(sys.argv) == 6 else ACTUATION_RATE
+
+# Set parameters and constants
+imsize = imwidth, imheight = 640, 480
+FPS = 30
+CHUNKS_PER_SLICE = 32   # Video chunks sent between chances for the loop to handle control
+
+
+class ControlProtocol(asyncio.DatagramProtocol):
+    """
+    Makes each steering/throttle datagram the actuator's target as soon as it arrives, unless
+    it's older than one already applied, and starts the outputs moving towards it straight
+    away. run_actuator() keeps them moving in between.
+    """
+    def __init__(self, actuator, metrics):
+        self.actuator = actuator
+        self.metrics = metrics
+        self.receiver = ControlReceiver()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, msg, addr):
+        received_at = time.time()
+        if msg == b'hiya':
+            print("Control client connected from {:}:{:}".format(addr[0], addr[1]))
+            self.receiver.reset()
+            return
+        reply = self.receiver.answer_clock(msg, received_at)
+        if reply is not None:
+            self.transport.sendto(reply, addr)
+            return
+        command = self.receiver.accept(msg)
+        if command is None:
+            return
+
+        self.actuator.set_targets(command.steering, command.throttle)
+        left_right_pwm, front_back_pwm = self.actuator.update(time.monotonic())
+        self.metrics.add_latency(
+            'input_to_actuation', latency(command.timestamp, self.receiver.clock_offset)
+        )
+
+        print('\r', end='')
+        print(
+            'Front/Back: {:.2f} ({:>3})   -    Left/Right: {:.2f}  ({:>3})  '.format(
+                command.throttle, front_back_pwm, command.steering, left_right_pwm
+            ),
+            end=''
+        )
+
+
+class VideoProtocol(asyncio.DatagramProtocol):
+    """
+    Answers video clients' HELLOs by (re)starting the stream to them and their clock sync
+    requests, and keeps their feedback, passing it on to the stream's bitrate controller if
+    it's adaptive.
+
+    `writable` is clear while the transport's send buffer is too full to take more video.
+    """
+    def __init__(self):
+        self.transport = None
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.stream = None
+        self.feedback = None
+        self.bitrate = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def pause_writing(self):
+        self.writable.clear()
+
+    def resume_writing(self):
+        self.writable.set()
+
+    def datagram_received(self, msg, addr):
+        answer = answer_clock_request(msg, time.time())
+        if answer is not None:
+            self.transport.sendto(answer[0], addr)
+            return
+        feedback = parse_feedback(msg)
+        if feedback is not None:
+            self.feedback = feedback
+            if self.bitrate is not None and self.bitrate.update(feedback, time.monotonic()):
+                print("\nVideo now at", self.bitrate.describe())
+            return
+        if not is_hello(msg):
+            return
+
+        reply, chunk_size, fec_group = answer_hello(msg)
+        self.transport.sendto(reply, addr)
+        print("\nVideo client connected from {:}:{:}, sending {:} byte chunks".format(
+            addr[0], addr[1], chunk_size
+        ))
+
+        if self.stream is not None:
+            self.stream.cancel()
+        self.bitrate = BitrateController() if adaptive else None
+        self.stream = asyncio.ensure_future(
+            stream_video(self, addr, Packetizer(chunk_size, fec_group), self.bitrate)
+        )
+        self.stream.add_done_callback(self.stream_done)
+
+    def stream_done(self, stream):
+        if stream.cancelled() or stream.exception() is None:
+            return
+        print("\nThe video stream failed, waiting for the client to reconnect:")
+        error = stream.exception()
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+
+async def run_actuator(actuator, metrics):
+    """
+    Step the outputs towards their targets at the actuation rate.
+    """
+    loop = asyncio.get_running_loop()
+    actuate_span = metrics.span('actuate')
+    while True:
+        t0 = loop.time()
+        with actuate_span:
+            actuator.update(time.monotonic())
+        metrics.tick()
+        await asyncio.sleep(max(0, (1 / actuation_rate) - (loop.time() - t0)))
+
+
+async def send_datagram(protocol, header, payload, addr):
+    """
+    Send one chunk through the VideoProtocol's transport, first waiting for its send buffer to
+    drain if it has filled up.
+    """
+    await protocol.writable.wait()
+    # The header buffer is reused for the next chunk, and the transport may queue this one
+    protocol.transport.sendto(bytes(header) + payload, addr)
+
+
+async def stream_video(protocol, addr, packetizer, bitrate=None):
+    loop = asyncio.get_running_loop()
+    frame_source = CheckerboardSource(imwidth, imheight, FPS)
+    frame = np.empty_like(frame_source.frame)
+    frame_codec, scale, fps = codec, 1, FPS
+
+    while True:
+        t0 = loop.time()
+        if bitrate is not None:
+            # Notices if the client has gone quiet, feedback is passed on as it arrives
+            if bitrate.update(None, time.monotonic()):
+                print("\nVideo now at", bitrate.describe())
+            frame_codec, scale, fps = bitrate.codec, bitrate.point.scale, bitrate.point.fps
+
+        frame_source.next_frame(out=frame)
+        captured_at = time.time()
+        # Off the loop, the codecs release the GIL while they work
+        encoded = await loop.run_in_executor(
+            None, frame_codec.encode, frame[::scale, ::scale] if scale > 1 else frame
+        )
+
+        chunks = packetizer.chunks(encoded, frame_codec.codec_id, captured_at)
+        for ndx, (header, payload) in enumerate(chunks):
+            await send_datagram(protocol, header, payload, addr)
+            if ndx % CHUNKS_PER_SLICE == CHUNKS_PER_SLICE - 1:
+                await asyncio.sleep(0)
+
+        # Cap the FPS
+        elapsed_time = loop.time() - t0
+        await asyncio.sleep(max(0, (1 / fps) - elapsed_time))
+
+
+def bind_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    sock.setblocking(False)
+    return sock
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+
+    # Actuation, I2C write and input to actuation timings, dumped to the file named by
+    # RPICAR_METRICS if it's set
+    metrics = open_metrics()
+    actuator = Actuator(open_pwm(metrics=metrics), open_calibration())
+    actuator_task = asyncio.ensure_future(run_actuator(actuator, metrics))
+
+    control_sock = bind_socket(control_port)
+    await loop.create_datagram_endpoint(lambda: ControlProtocol(actuator, metrics), sock=control_sock)
+
+    video_sock = bind_socket(video_port)
+    await loop.create_datagram_endpoint(VideoProtocol, sock=video_sock)
+
+    print("Waiting for client connections...")
+    await actuator_task
+
+
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    print("caught keyboard interrupt, exiting")
@@ -0,0 +1,146 @@
+"""
+Estimating the clock offset between the driver station and the car, NTP style, so timestamps
+taken on one can be compared with times on the other.
+
+The client sends a CLOCK_REQUEST with its time.time() send time t0. The server replies with a
+CLOCK_REPLY echoing t0 along with the time the request arrived, t1, and the time the reply was
+sent, t2, and the client notes when the reply arrived, t3. Then
+
+    offset = ((t1 - t0) + (t2 - t3)) / 2    (server clock minus client clock)
+    delay = (t3 - t0) - (t2 - t1)           (network round trip)
+
+assuming the trip takes as long each way. The offset from the sample with the least delay
+among the last few is used, as that's the one least thrown off by queueing. Each request also
+carries the client's current estimate, so the server learns the offset too.
+
+Arrival times come from the kernel where it can timestamp datagrams (Linux), so they aren't
+thrown off by how long a busy loop takes to get round to reading them.
+
+The exchange runs over the sockets the video and control streams already use. Requests and
+replies start with CLOCK_MAGIC, which never starts a control message or a video datagram that
+a server reads.
+"""
+import math
+import socket
+import struct
+import sys
+import time
+from collections import deque
+
+CLOCK_MAGIC = b'tick'
+CLOCK_REQUEST = struct.Struct('>4sdd')   # magic, t0, client's offset estimate (NaN if none)
+CLOCK_REPLY = struct.Struct('>4sddd')    # magic, t0, t1, t2
+CLOCK_SYNC_INTERVAL = 0.5  # seconds
+
+# Not every Python exposes it, but it's the same on all the Linux architectures we run on
+SO_TIMESTAMPNS = getattr(
+    socket, 'SO_TIMESTAMPNS', 35 if sys.platform.startswith('linux') else None
+)
+TIMESPEC = struct.Struct('@ll')
+
+
+def enable_timestamps(sock):
+    """
+    Ask the kernel to timestamp datagrams arriving on `sock`. Returns whether it will.
+    """
+    if SO_TIMESTAMPNS is None:
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError:
+        return False
+    return True
+
+
+def recv_timestamped(sock, bufsize):
+    """
+    Receive a datagram, returning (msg, addr, arrival time). The arrival time is the kernel's
+    timestamp if enable_timestamps() worked on `sock`, otherwise the time it was read.
+    """
+    if not hasattr(sock, 'recvmsg'):
+        msg, addr = sock.recvfrom(bufsize)
+        return msg, addr, time.time()
+
+    msg, ancdata, _, addr = sock.recvmsg(bufsize, socket.CMSG_SPACE(TIMESPEC.size))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+            seconds, nanoseconds = TIMESPEC.unpack_from(data)
+            return msg, addr, seconds + nanoseconds / 1e9
+    return msg, addr, time.time()
+
+
+def answer_clock_request(msg, received_at):
+    """
+    If `msg` is a CLOCK_REQUEST, returns (reply datagram, the client's offset estimate or None),
+    otherwise None. `received_at` is the request's arrival time.
+    """
+    if len(msg) != CLOCK_REQUEST.size or msg[:4] != CLOCK_MAGIC:
+        return None
+    _, t0, client_offset = CLOCK_REQUEST.unpack(msg)
+    reply = CLOCK_REPLY.pack(CLOCK_MAGIC, t0, received_at, time.time())
+    return reply, None if math.isnan(client_offset) else client_offset
+
+
+class ClockSync:
+    """
+    The client's estimate of the server's clock offset, from the last `samples` exchanges.
+
+    `offset` (server minus client, in seconds) and `delay` are None until a reply arrives.
+    """
+    def __init__(self, samples=16, interval=CLOCK_SYNC_INTERVAL):
+        self.samples = deque(maxlen=samples)
+        self.interval = interval
+        self.offset = None
+        self.delay = None
+        self.last_request = None
+
+    def due(self, now):
+        """
+        Whether it's time to send another request. `now` is a time.monotonic() value.
+        """
+        return self.last_request is None or now - self.last_request >= self.interval
+
+    def request(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.last_request = now
+        offset = math.nan if self.offset is None else self.offset
+        return CLOCK_REQUEST.pack(CLOCK_MAGIC, time.time(), offset)
+
+    def handle_reply(self, msg, received_at):
+        """
+        Take in a CLOCK_REPLY that arrived at `received_at`. Returns False if `msg` isn't one.
+        """
+        if len(msg) != CLOCK_REPLY.size or msg[:4] != CLOCK_MAGIC:
+            return False
+        _, t0, t1, t2 = CLOCK_REPLY.unpack(msg)
+        delay = (received_at - t0) - (t2 - t1)
+        if delay < 0:
+            # Clock stepped mid exchange
+            return True
+        self.samples.append((delay, ((t1 - t0) + (t2 - received_at)) / 2))
+        self.delay, self.offset = min(self.samples)
+        return True
+
+    def drain(self, sock):
+        """
+        Take in every reply waiting on the non-blocking `sock`.
+        """
+        while True:
+            try:
+                msg, _, received_at = recv_timestamped(sock, CLOCK_REPLY.size + 1)
+            except BlockingIOError:
+                return
+            self.handle_reply(msg, received_at)
+
+
+def latency(sent_at, offset, now=None):
+    """
+    How long ago `sent_at`, a time.time() on the other machine, was on this machine's clock,
+    given `offset` (this clock minus the other). None if the offset isn't known yet.
+    """
+    if offset is None:
+        return None
+    if now is None:
+        now = time.time()
+    return now - (sent_at + offset)
@@ -0,0 +1,157 @@
+"""
+Steering and throttle inputs for the driver station.
+
+An input backend tracks the current (steering, throttle) inputs, each in [-1, 1]. Its wait()
+method blocks until there's new input or the timeout passes and returns them, and its `quit`
+attribute is set when the user closes the client. The backends are:
+
+    pygame   keyboard or joystick through pygame, which needs a display (see pygame_input.py)
+    gamepad  a gamepad read straight from evdev with the inputs library, no display needed
+    sweep    a stand-in for a joystick that sweeps both axes back and forth, for benchmarks
+
+pygame is only imported if its backend is picked, so the gamepad backend runs on a headless
+machine without it.
+"""
+import math
+import queue
+import threading
+import time
+
+try:
+    import inputs
+except ImportError:
+    inputs = None
+
+# Gamepad stick readings closer to centre than this, in raw counts, are treated as centred
+DEADBAND_COUNTS = 2000
+AXIS_RANGE = 32768
+# Triggers read from 0 when released to this when fully pulled (255 on an Xbox 360 pad)
+TRIGGER_RANGE = 1023
+# Left stick across steers. As with the pygame backend's axis 2, the right trigger drives
+# forwards and the left one backwards.
+STEERING_CODE = 'ABS_X'
+FORWARD_CODE = 'ABS_RZ'
+REVERSE_CODE = 'ABS_Z'
+
+
+class GamepadInput:
+    """
+    Tracks the steering and throttle inputs from the first gamepad the inputs library finds.
+
+    inputs.get_gamepad() blocks, so it's read on a daemon thread that queues the axis events.
+    """
+    def __init__(self):
+        if inputs is None:
+            raise Exception("The gamepad input backend needs the inputs library to be installed")
+        if not inputs.devices.gamepads:
+            raise Exception("No gamepad found")
+
+        self.left_right = 0.0
+        self.front_back = 0.0
+        self.forward = 0.0
+        self.reverse = 0.0
+        self.quit = False
+        self.error = None
+        self.events = queue.Queue()
+
+        threading.Thread(target=self._read, name='gamepad', daemon=True).start()
+
+    def _read(self):
+        try:
+            while True:
+                for event in inputs.get_gamepad():
+                    if event.code in (STEERING_CODE, FORWARD_CODE, REVERSE_CODE):
+                        self.events.put(event)
+        except Exception as e:  # pylint: disable=broad-except
+            self.error = e
+            self.events.put(None)
+
+    def _axis_value(self, state):
+        if abs(state) < DEADBAND_COUNTS:
+            return 0.0
+        return max(-1.0, min(1.0, state / AXIS_RANGE))
+
+    def _trigger_value(self, state):
+        return max(0.0, min(1.0, state / TRIGGER_RANGE))
+
+    def handle(self, event):
+        if event.code == STEERING_CODE:
+            self.left_right = self._axis_value(event.state)
+            return
+        if event.code == FORWARD_CODE:
+            self.forward = self._trigger_value(event.state)
+        elif event.code == REVERSE_CODE:
+            self.reverse = self._trigger_value(event.state)
+        self.front_back = self.forward - self.reverse
+
+    def wait(self, timeout):
+        """
+        Wait up to `timeout` seconds for input, then handle every event that's waiting.
+        Returns the (steering, throttle) inputs.
+        """
+        try:
+            event = self.events.get(timeout=max(0.0, timeout))
+            while event is not None:
+                self.handle(event)
+                event = self.events.get_nowait()
+        except queue.Empty:
+            pass
+
+        if self.error is not None:
+            raise Exception("Lost the gamepad: {:}".format(self.error))
+        return self.left_right, self.front_back
+
+
+class SweepInput:
+    """
+    Steering and throttle that sweep smoothly through [-1, 1], the steering every
+    `steering_period` seconds and the throttle every `throttle_period`, changing `rate` times a
+    second. Stands in for a driver so the control link can be exercised without any hardware.
+    """
+    def __init__(self, rate=100, steering_period=2.0, throttle_period=5.0):
+        self.interval = 1 / rate
+        self.steering_period = steering_period
+        self.throttle_period = throttle_period
+        self.start = time.monotonic()
+        self.next_change = self.start
+        self.left_right = 0.0
+        self.front_back = 0.0
+        self.quit = False
+
+    def wait(self, timeout):
+        """
+        Wait until the inputs next change or `timeout` seconds pass, whichever is sooner.
+        Returns the (steering, throttle) inputs.
+        """
+        now = time.monotonic()
+        delay = min(max(0.0, timeout), self.next_change - now)
+        if delay > 0:
+            time.sleep(delay)
+            now += delay
+        if now >= self.next_change:
+            elapsed = now - self.start
+            self.left_right = math.sin(2 * math.pi * elapsed / self.steering_period)
+            self.front_back = math.sin(2 * math.pi * elapsed / self.throttle_period)
+            self.next_change += self.interval
+            if self.next_change < now:
+                self.next_change = now + self.interval
+        return self.left_right, self.front_back
+
+
+INPUT_BACKENDS = ('pygame', 'gamepad', 'sweep')
+
+
+def open_input(backend='pygame'):
+    """
+    Start the named input backend.
+    """
+    if backend == 'pygame':
+        from pygame_input import PygameInput
+        return PygameInput()
+    if backend == 'gamepad':
+        return GamepadInput()
+    if backend == 'sweep':
+        return SweepInput()
+    raise ValueError(
+        "Unknown input backend '{:}', choose from {:}".format(backend, ', '.join(INPUT_BACKENDS))
+    )
@@ -0,0 +1,105 @@
+"""
+The binary protocol for control messages from the driver station to the car.
+
+Every message is a HEADER (protocol version, message type, uint32 sequence number and the
+sender's float64 time.time() timestamp, big endian) followed by a payload that depends on the
+type:
+
+    MSG_AXES     steering and throttle as int16 fixed point, i.e. [-1, 1] scaled by 32767
+    MSG_BUTTONS  a uint16 bitmask of pressed buttons, bit n for button n
+    MSG_HAT      the hat's x and y positions as int8s, each -1, 0 or 1
+
+Each message type has one precompiled struct covering header and payload, so packing or
+unpacking a message is a single call. Receivers ignore messages from other protocol versions
+and of types they don't know, so new types can be added without breaking older cars.
+
+Clients still open the stream by sending b'hiya', which also restarts the sequence.
+"""
+import struct
+from collections import namedtuple
+
+PROTOCOL_VERSION = 1
+
+MSG_AXES = 1
+MSG_BUTTONS = 2
+MSG_HAT = 3
+
+HEADER = struct.Struct('>BBId')  # version, message type, sequence, timestamp
+AXES_MESSAGE = struct.Struct(HEADER.format + 'hh')
+BUTTONS_MESSAGE = struct.Struct(HEADER.format + 'H')
+HAT_MESSAGE = struct.Struct(HEADER.format + 'bb')
+MAX_MESSAGE_SIZE = max(AXES_MESSAGE.size, BUTTONS_MESSAGE.size, HAT_MESSAGE.size)
+
+AXIS_SCALE = 32767
+
+AxesMessage = namedtuple('AxesMessage', ['seq', 'timestamp', 'steering', 'throttle'])
+ButtonsMessage = namedtuple('ButtonsMessage', ['seq', 'timestamp', 'buttons'])
+HatMessage = namedtuple('HatMessage', ['seq', 'timestamp', 'x', 'y'])
+
+
+def axis_to_fixed(value):
+    return int(max(-1.0, min(1.0, value)) * AXIS_SCALE + (0.5 if value >= 0 else -0.5))
+
+
+def pack_axes(seq, timestamp, steering, throttle):
+    return AXES_MESSAGE.pack(
+        PROTOCOL_VERSION, MSG_AXES, seq & 0xFFFFFFFF, timestamp,
+        axis_to_fixed(steering), axis_to_fixed(throttle)
+    )
+
+
+def pack_buttons(seq, timestamp, buttons):
+    """
+    `buttons` is a bitmask, see buttons_to_mask().
+    """
+    return BUTTONS_MESSAGE.pack(PROTOCOL_VERSION, MSG_BUTTONS, seq & 0xFFFFFFFF, timestamp, buttons)
+
+
+def pack_hat(seq, timestamp, x, y):
+    return HAT_MESSAGE.pack(PROTOCOL_VERSION, MSG_HAT, seq & 0xFFFFFFFF, timestamp, x, y)
+
+
+def buttons_to_mask(pressed):
+    """
+    The bitmask for a sequence of button states, the first being button 0.
+    """
+    mask = 0
+    for ndx, button in enumerate(pressed[:16]):
+        if button:
+            mask |= 1 << ndx
+    return mask
+
+
+def _unpack_axes(msg):
+    _, _, seq, timestamp, steering, throttle = AXES_MESSAGE.unpack(msg)
+    return AxesMessage(seq, timestamp, steering / AXIS_SCALE, throttle / AXIS_SCALE)
+
+
+def _unpack_buttons(msg):
+    _, _, seq, timestamp, buttons = BUTTONS_MESSAGE.unpack(msg)
+    return ButtonsMessage(seq, timestamp, buttons)
+
+
+def _unpack_hat(msg):
+    _, _, seq, timestamp, x, y = HAT_MESSAGE.unpack(msg)
+    return HatMessage(seq, timestamp, x, y)
+
+
+_MESSAGES = {
+    MSG_AXES: (AXES_MESSAGE.size, _unpack_axes),
+    MSG_BUTTONS: (BUTTONS_MESSAGE.size, _unpack_buttons),
+    MSG_HAT: (HAT_MESSAGE.size, _unpack_hat),
+}
+
+
+def unpack_message(msg):
+    """
+    The AxesMessage, ButtonsMessage or HatMessage in `msg`, or None if it isn't a message this
+    version of the protocol understands.
+    """
+    if len(msg) < HEADER.size or msg[0] != PROTOCOL_VERSION:
+        return None
+    size, unpack = _MESSAGES.get(msg[1], (None, None))
+    if size != len(msg):
+        return None
+    return unpack(msg)
@@ -38,7 +38,10 @@ Start loop:
 import numpy as np
 import sys, pygame, time
 import socket
-import struct
+
+from control_protocol import buttons_to_mask, pack_axes, pack_buttons, pack_hat
+from hud import Hud
+from metrics import open_metrics
 
 if len(sys.argv) != 4:
     print(f"Usage: {sys.argv[0]} <host> <port> <myport>")
@@ -57,28 +60,6 @@ FPS = 30
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
-class TextPrint:
-    def __init__(self):
-        self.reset()
-        self.font = pygame.font.Font(None, 20)
-
-    def print(self, screen, textString):
-        textBitmap = self.font.render(textString, True, BLACK)
-        screen.blit(textBitmap, [self.x, self.y])
-        self.y += self.line_height
-        
-    def reset(self):
-        self.x = imwidth + 10
-        self.y = 10
-        self.line_height = 15
-        
-    def indent(self):
-        self.x += 10
-        
-    def unindent(self):
-        self.x -= 10
-
-
 # Initialize stuff
 screen = pygame.display.set_mode(size)
 pygame.display.set_caption("RPiCar Client")
@@ -89,13 +70,32 @@ camera_image = pygame.surfarray.make_surface(random_image).convert()
 joystick = pygame.joystick.Joystick(0)
 joystick.init()
 
-text_print = TextPrint()
+# Per-stage timings, dumped to the file named by RPICAR_METRICS if it's set
+metrics = open_metrics()
+
+SPANS = ('input', 'send', 'draw', 'flip')
+screen.fill(WHITE)
+hud = Hud((imwidth, 0, width - imwidth, height), [
+    'Inputs sent to server:',
+    '  Ax1: {:5.2f}',
+    '  Ax2: {:5.2f}',
+    '  Buttons: {:016b}',
+    '  Hat: {}',
+    '',
+    '<-- Image received from server',
+    '',
+    'Times (ms):     p50     p95     p99',
+] + ['  {:}: {{}}'.format(name) for name in SPANS])
 pygame.joystick.init()
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind(('127.0.0.1', myport))
 sock.sendto(b'hiya', server_addr)
 
+seq = 0
+buttons = None
+hat = None
+
 while True:
     t0 = time.time()
 
@@ -104,34 +104,43 @@ while True:
         if event.type == pygame.QUIT:  
             sys.exit()
 
-    # Reset the screen and text processor
-    screen.fill(WHITE)
-    text_print.reset()
-
+    input_start = time.perf_counter_ns()
     left_right = joystick.get_axis(0)
     front_back = -1.0 * joystick.get_axis(2)
-    joy_input = struct.pack('>f', left_right) + struct.pack('>f', front_back)
-
-    sock.sendto(joy_input, server_addr)
-
-    text_print.print(screen, 'Inputs sent to server:')
-    text_print.indent()
-    text_print.print(screen, 'Ax1: {:.2f}'.format(left_right))
-    text_print.print(screen, 'Ax2: {:.2f}'.format(front_back))
-
-    text_print.unindent()
-    text_print.print(screen, '')
-    text_print.print(screen, '<-- Image received from server')
+    new_buttons = buttons_to_mask(
+        [joystick.get_button(i) for i in range(joystick.get_numbuttons())]
+    )
+    new_hat = joystick.get_hat(0) if joystick.get_numhats() > 0 else (0, 0)
+    send_start = time.perf_counter_ns()
+    metrics.record('input', input_start, send_start)
+
+    sock.sendto(pack_axes(seq, time.time(), left_right, front_back), server_addr)
+    seq += 1
+
+    # Buttons and the hat are only sent when they change
+    if new_buttons != buttons:
+        buttons = new_buttons
+        sock.sendto(pack_buttons(seq, time.time(), buttons), server_addr)
+        seq += 1
+
+    if new_hat != hat:
+        hat = new_hat
+        sock.sendto(pack_hat(seq, time.time(), *hat), server_addr)
+        seq += 1
+    metrics.record('send', send_start)
+
+    metrics.tick()
+    with metrics.span('draw'):
+        hud.draw(
+            screen, left_right, front_back, buttons, hat,
+            *[metrics.format(name) for name in SPANS]
+        )
+
+    with metrics.span('flip'):
+        pygame.display.flip()
 
     # Cap the FPS
     elapsed_time = time.time() - t0
 
-    text_print.print(screen, '')
-    text_print.print(screen, "Frame time: {:.2f} ms".format((elapsed_time * 1000)))
-
-    pygame.display.flip()
-
-    elapsed_time = time.time() - t0
-
     if ((1 / FPS) - elapsed_time) > 0:
         time.sleep((1 / FPS) - elapsed_time)
@@ -53,7 +53,11 @@ Start loop:
 import numpy as np
 import sys, pygame, time
 import socket
-import struct
+
+from control_protocol import (
+    MAX_MESSAGE_SIZE, AxesMessage, ButtonsMessage, HatMessage, unpack_message
+)
+from hud import Hud
 
 if len(sys.argv) != 3:
     print(f"Usage: {sys.argv[0]} <host> <port>")
@@ -71,28 +75,6 @@ FPS = 30
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
-class TextPrint:
-    def __init__(self):
-        self.reset()
-        self.font = pygame.font.Font(None, 20)
-
-    def print(self, screen, textString):
-        textBitmap = self.font.render(textString, True, BLACK)
-        screen.blit(textBitmap, [self.x, self.y])
-        self.y += self.line_height
-        
-    def reset(self):
-        self.x = imwidth + 10
-        self.y = 10
-        self.line_height = 15
-        
-    def indent(self):
-        self.x += 10
-        
-    def unindent(self):
-        self.x -= 10
-
-
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind(server_addr)
 
@@ -109,7 +91,23 @@ print(f"Connected with {addr[0]}:{addr[1]}")
 screen = pygame.display.set_mode(size)
 pygame.display.set_caption("RPiCar Server")
 
-text_print = TextPrint()
+screen.fill(WHITE)
+hud = Hud((imwidth, 0, width - imwidth, height), [
+    'Inputs received from client:',
+    '  Ax1: {:5.2f}',
+    '  Ax2: {:5.2f}',
+    '  Buttons: {:016b}',
+    '  Hat: {}',
+    '',
+    '<-- Image transmitted to client',
+    '',
+    "Frame time: {:6.2f} ms",
+])
+
+sock.setblocking(False)
+ax1 = ax2 = 0.0
+buttons = 0
+hat = (0, 0)
 
 # NOTE: Max size for UDP is practially around 500 bytes I guess?
 counter = 0
@@ -123,31 +121,24 @@ while True:
         if event.type == pygame.QUIT:  
             sys.exit()
 
-    # Reset the screen and text processor
-    screen.fill(WHITE)
-    text_print.reset()
-
-    # Receive two float32s from the client, one per axis of control (throttle and steering)
-    msg, addr = sock.recvfrom(8)
-    if not msg:
-        break
-    ax1 = struct.unpack('>f', msg[:4])[0]
-    ax2 = struct.unpack('>f', msg[4:])[0]
-
-    text_print.print(screen, 'Inputs received from client:')
-    text_print.indent()
-    text_print.print(screen, 'Ax1: {:.2f}'.format(ax1))
-    text_print.print(screen, 'Ax2: {:.2f}'.format(ax2))
-
-    text_print.unindent()
-    text_print.print(screen, '')
-    text_print.print(screen, '<-- Image transmitted to client')
+    # Handle every control message the client has sent since the last frame
+    while True:
+        try:
+            msg, addr = sock.recvfrom(MAX_MESSAGE_SIZE + 1)
+        except BlockingIOError:
+            break
+        message = unpack_message(msg)
+        if isinstance(message, AxesMessage):
+            ax1, ax2 = message.steering, message.throttle
+        elif isinstance(message, ButtonsMessage):
+            buttons = message.buttons
+        elif isinstance(message, HatMessage):
+            hat = (message.x, message.y)
 
     # Cap the FPS
     elapsed_time = time.time() - t0
 
-    text_print.print(screen, '')
-    text_print.print(screen, "Frame time: {:.2f} ms".format((elapsed_time * 1000)))
+    hud.draw(screen, ax1, ax2, buttons, hat, elapsed_time * 1000)
 
     pygame.display.flip()
 
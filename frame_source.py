@@ -0,0 +1,59 @@
+"""
+Synthetic frame sources, used to exercise the video link without a camera.
+"""
+import numpy as np
+
+
+class CheckerboardSource:
+    """
+    A black and white checkerboard of `square` pixel tiles that inverts every `period` frames.
+
+    Both phases of the board are built once up front, and next_frame() always returns the same
+    preallocated (width, height, 3) buffer, which is only rewritten when the phase flips. This
+    keeps the cost of generating a frame close to zero so the frame time we measure is the
+    transport, not the synthetic source.
+    """
+    def __init__(self, width, height, period, square=40, dtype='uint8'):
+        self.width = width
+        self.height = height
+        self.period = period
+
+        # Colour index of each pixel, 0 for the top left tile, alternating across both axes
+        tile_ndx = (
+            (np.arange(width) // square)[:, None] +
+            (np.arange(height) // square)[None, :]
+        ) % 2
+        white = np.where(tile_ndx == 0, 255, 0).astype(dtype)
+        self.phases = [
+            np.repeat(white[:, :, None], 3, axis=2),
+            np.repeat((255 - white)[:, :, None], 3, axis=2),
+        ]
+        for phase in self.phases:
+            phase.flags.writeable = False
+
+        self.frame = np.empty((width, height, 3), dtype=dtype)
+        self.counter = 0
+        self.phase_ndx = 0
+        np.copyto(self.frame, self.phases[self.phase_ndx])
+
+    def next_frame(self, out=None):
+        """
+        Return the frame for the current tick and advance the counter.
+
+        Without `out` the returned array is the source's own buffer, which is reused on every
+        call, so copy it if it needs to outlive the tick. Otherwise the frame is written into
+        `out`, which is returned.
+        """
+        phase_ndx = (self.counter // self.period) % 2
+        self.counter += 1
+        if self.counter >= 2 * self.period:
+            self.counter = 0
+
+        if out is not None:
+            np.copyto(out, self.phases[phase_ndx])
+            return out
+
+        if phase_ndx != self.phase_ndx:
+            self.phase_ndx = phase_ndx
+            np.copyto(self.frame, self.phases[phase_ndx])
+        return self.frame
@@ -0,0 +1,162 @@
+"""
+Text for the pygame tools' heads-up displays.
+
+TextPrint prints lines down a surface, like the class each script used to carry its own copy
+of, but rendered text comes from an LRU cache keyed by (string, color) that everything using
+the same font size shares, so a line that hasn't changed is never rendered again.
+
+Hud goes further for panels whose layout doesn't change: the static labels are rendered once
+onto a background layer, and each frame only the values are rendered and drawn, over just the
+strips of the layer they cover. Give numbers fixed width formats, e.g. '{:6.2f}', so they
+don't shift about and repeat values hit the cache.
+
+pygame must be initialised before any of these are created.
+"""
+from collections import OrderedDict
+
+import pygame
+
+BLACK = (0, 0, 0)
+WHITE = (255, 255, 255)
+
+CACHE_SIZE = 512
+
+_text_caches = {}
+
+
+class TextCache:
+    """
+    An LRU cache of up to `maxsize` surfaces of text rendered in `font`.
+    """
+    def __init__(self, font, maxsize=CACHE_SIZE):
+        self.font = font
+        self.maxsize = maxsize
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text, color=BLACK):
+        key = (text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            self.misses += 1
+            surface = self.surfaces[key] = self.font.render(text, True, color)
+            if len(self.surfaces) > self.maxsize:
+                self.surfaces.popitem(last=False)
+        else:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+        return surface
+
+
+def get_text_cache(font_size=20):
+    """
+    The TextCache shared by everything using the default font at `font_size`.
+    """
+    text_cache = _text_caches.get(font_size)
+    if text_cache is None:
+        text_cache = _text_caches[font_size] = TextCache(pygame.font.Font(None, font_size))
+    return text_cache
+
+
+class TextPrint:
+    """
+    Prints lines of text down a surface, starting at (x, y).
+    """
+    def __init__(self, x=10, y=10, line_height=15, font_size=20, color=BLACK):
+        self.origin = (x, y)
+        self.line_height = line_height
+        self.color = color
+        self.text_cache = get_text_cache(font_size)
+        self.reset()
+
+    def print(self, screen, textString):
+        screen.blit(self.text_cache.render(textString, self.color), [self.x, self.y])
+        self.y += self.line_height
+
+    def print_value(self, screen, label, value):
+        """
+        Print `label` followed by `value`, an already formatted string that changes often, so
+        the label stays cached whatever the value.
+        """
+        label_surface = self.text_cache.render(label, self.color)
+        screen.blit(label_surface, [self.x, self.y])
+        screen.blit(
+            self.text_cache.render(value, self.color),
+            [self.x + label_surface.get_width(), self.y]
+        )
+        self.y += self.line_height
+
+    def reset(self):
+        self.x, self.y = self.origin
+
+    def indent(self):
+        self.x += 10
+
+    def unindent(self):
+        self.x -= 10
+
+
+class Hud:
+    """
+    A panel of text lines covering `rect` of the screen.
+
+    Each line is either static text or a label followed by a single format field, e.g.
+    "Frame time: {:6.2f} ms", whose value is passed to draw(). The labels and static lines are
+    precomposed onto a background layer once, here.
+
+    After the first draw() onto a screen only the value strips are redrawn, so call
+    invalidate() if anything else draws over the panel.
+    """
+    def __init__(self, rect, lines, x=10, y=10, line_height=15, font_size=20, color=BLACK,
+                 background=WHITE):
+        self.rect = pygame.Rect(rect)
+        self.color = color
+        self.text_cache = get_text_cache(font_size)
+
+        self.layer = pygame.Surface(self.rect.size)
+        self.layer.fill(background)
+        if pygame.display.get_surface() is not None:
+            self.layer = self.layer.convert()
+
+        # (screen area, format) of each value
+        self.fields = []
+        self.screen = None
+        text_print = TextPrint(x, y, line_height, font_size, color)
+        for line in lines:
+            label, brace, fmt = line.partition('{')
+            label_width = self.text_cache.render(label, color).get_width()
+            if brace:
+                left = self.rect.x + text_print.x + label_width
+                area = pygame.Rect(
+                    left, self.rect.y + text_print.y, self.rect.right - left, line_height
+                )
+                self.fields.append((area.clip(self.rect), brace + fmt))
+            text_print.print(self.layer, label)
+        areas = [area for area, _ in self.fields]
+        self.fields_rect = areas[0].unionall(areas[1:]) if areas else pygame.Rect(0, 0, 0, 0)
+
+    def invalidate(self):
+        """
+        Draw the whole panel next time.
+        """
+        self.screen = None
+
+    def draw(self, screen, *values):
+        """
+        Draw the panel with `values` for its fields, in order. A value of None leaves its
+        field blank. Returns the rect that changed, for display.update().
+        """
+        if screen is not self.screen:
+            screen.blit(self.layer, self.rect)
+            self.screen = screen
+            dirty = self.rect
+        else:
+            for area, _ in self.fields:
+                screen.blit(self.layer, area, area.move(-self.rect.x, -self.rect.y))
+            dirty = self.fields_rect
+
+        for (area, fmt), value in zip(self.fields, values):
+            if value is not None:
+                screen.blit(self.text_cache.render(fmt.format(value), self.color), area)
+        return dirty
@@ -0,0 +1,213 @@
+"""
+Lightweight latency metrics for the video and control loops.
+
+Durations are measured with time.perf_counter_ns() and counted into fixed-bucket histograms,
+one per named span (e.g. 'encode', 'send', 'blit'), so recording one is a clock read, a bisect
+and a couple of additions, with nothing allocated. Percentiles are read off the buckets, as
+their bucket's upper bound, so they can overstate the true value by up to one bucket, which is
+2 ** (1 / 4) or about 19% wide. End-to-end latencies between the car and the driver station
+are counted the same way, once clock_sync.py knows the offset between them.
+
+Metrics.tick() starts a new window every `interval` seconds, first appending the finished
+window's summary to `dump_path` if one was given: a CSV file if it ends in .csv, otherwise
+JSON lines. Running totals set with set_counter() (frames, packets, bytes) and the process's
+CPU time are dumped along with it. open_metrics() takes the path from the RPICAR_METRICS
+environment variable and the interval from RPICAR_METRICS_INTERVAL. Tools with a HUD show the
+last window's percentiles.
+"""
+import bisect
+import json
+import os
+import time
+
+# Bucket upper bounds in ns, four per doubling from 1 us to about 17 s
+BUCKET_BOUNDS_NS = tuple(int(1000 * 2 ** (n / 4)) for n in range(97))
+
+DUMP_INTERVAL = 2.0
+
+SUMMARY_FIELDS = ('count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+
+
+class Histogram:
+    """
+    Counts durations, in ns, into fixed buckets.
+    """
+    def __init__(self, bounds=BUCKET_BOUNDS_NS):
+        self.bounds = bounds
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ns):
+        self.counts[bisect.bisect_left(self.bounds, ns)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p):
+        """
+        The upper bound of the bucket holding the `p`th percentile (0-100), in ns, but never
+        more than the largest duration seen. 0 if nothing has been counted.
+        """
+        if not self.count:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for ndx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[ndx], self.max) if ndx < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1e6 if self.count else 0.0,
+            'p50_ms': self.percentile(50) / 1e6,
+            'p95_ms': self.percentile(95) / 1e6,
+            'p99_ms': self.percentile(99) / 1e6,
+            'max_ms': self.max / 1e6,
+        }
+
+
+class _Span:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.add(time.perf_counter_ns() - self.start)
+
+
+class Metrics:
+    """
+    Histograms of named spans, in windows of `interval` seconds.
+
+    Time a block with `with metrics.span('encode'):`, or pass a perf_counter_ns() start time
+    to record(). Spans can be recorded from any thread, but each name's span object is reused
+    so two spans with the same name mustn't overlap.
+    """
+    def __init__(self, dump_path=None, interval=DUMP_INTERVAL):
+        self.dump_path = dump_path
+        self.interval = interval
+        self.histograms = {}
+        self.spans = {}
+        self.last = {}
+        self.counters = {}
+        self.window_start = time.monotonic()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def span(self, name):
+        span = self.spans.get(name)
+        if span is None:
+            span = self.spans.setdefault(name, _Span(self.histogram(name)))
+        return span
+
+    def record(self, name, start_ns, end_ns=None):
+        if end_ns is None:
+            end_ns = time.perf_counter_ns()
+        self.histogram(name).add(end_ns - start_ns)
+
+    def add(self, name, ns):
+        self.histogram(name).add(ns)
+
+    def add_latency(self, name, seconds):
+        """
+        Record a latency between machines, in seconds, e.g. from clock_sync.latency(). None
+        (no clock offset yet) is skipped, and anything the offset's error makes negative
+        counts as 0.
+        """
+        if seconds is not None:
+            self.histogram(name).add(max(0, int(seconds * 1e9)))
+
+    def set_counter(self, name, value):
+        """
+        Set the running total `name`, e.g. frames sent so far, to be dumped with each window.
+        """
+        self.counters[name] = value
+
+    def summary(self):
+        """
+        The current window's summary of each span, by name.
+        """
+        return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def tick(self, now=None):
+        """
+        If the window is over, dump it and start a new one. `now` is a time.monotonic() value.
+        Returns whether a new window started.
+        """
+        if now is None:
+            now = time.monotonic()
+        if now - self.window_start < self.interval:
+            return False
+        self.window_start = now
+
+        self.last = self.summary()
+        for histogram in list(self.histograms.values()):
+            histogram.reset()
+        if self.dump_path:
+            self.dump(self.last)
+        return True
+
+    def dump(self, summary):
+        timestamp = time.time()
+        counters = dict(self.counters, cpu_time=time.process_time())
+        if self.dump_path.endswith('.csv'):
+            new_file = not os.path.exists(self.dump_path)
+            with open(self.dump_path, 'a') as f:
+                if new_file:
+                    f.write(','.join(('time', 'span') + SUMMARY_FIELDS) + '\n')
+                for name, values in summary.items():
+                    f.write(','.join(
+                        ['{:.3f}'.format(timestamp), name, str(values['count'])] +
+                        ['{:.4f}'.format(values[field]) for field in SUMMARY_FIELDS[1:]]
+                    ) + '\n')
+                # Counters only fill in the count column
+                for name, value in sorted(counters.items()):
+                    f.write(','.join(
+                        ['{:.3f}'.format(timestamp), name, str(value)] +
+                        [''] * (len(SUMMARY_FIELDS) - 1)
+                    ) + '\n')
+        else:
+            with open(self.dump_path, 'a') as f:
+                f.write(json.dumps(
+                    {'time': timestamp, 'counters': counters, 'spans': summary}
+                ) + '\n')
+
+    def format(self, name):
+        """
+        The last window's percentiles of span `name` for a HUD, in a fixed width.
+        """
+        values = self.last.get(name)
+        if values is None:
+            return '    -'
+        return '{:6.2f} {:6.2f} {:6.2f}'.format(values['p50_ms'], values['p95_ms'], values['p99_ms'])
+
+
+def open_metrics(dump_path=None, interval=None):
+    """
+    A Metrics dumping to `dump_path`, by default the path in the RPICAR_METRICS environment
+    variable. Without either nothing is written out. The window length is `interval`, or
+    RPICAR_METRICS_INTERVAL, or DUMP_INTERVAL seconds.
+    """
+    if dump_path is None:
+        dump_path = os.environ.get('RPICAR_METRICS')
+    if interval is None:
+        interval = float(os.environ.get('RPICAR_METRICS_INTERVAL', DUMP_INTERVAL))
+    return Metrics(dump_path, interval)
@@ -0,0 +1,174 @@
+"""
+A small staged pipeline for the video server, so capturing, encoding and sending a frame can
+overlap instead of running one after the other on the main thread.
+
+Each stage is a daemon thread connected to the next by a LatestQueue. The queues are bounded
+and drop their oldest item when full, so a slow stage sheds frames instead of letting latency
+build up. Threads are enough here as both the codecs (zlib, Pillow) and socket sends release
+the GIL while they work.
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class LatestQueue(queue.Queue):
+    """
+    A bounded queue whose put_latest() makes room by dropping the oldest item.
+
+    Dropped items are handed to `on_drop`, e.g. to return their buffers to a pool.
+    """
+    def __init__(self, maxsize=1, on_drop=None):
+        super().__init__(maxsize)
+        self.on_drop = on_drop
+        self.dropped = 0
+
+    def put_latest(self, item):
+        while True:
+            try:
+                self.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            try:
+                oldest = self.get_nowait()
+            except queue.Empty:
+                continue
+            self.dropped += 1
+            if self.on_drop is not None:
+                self.on_drop(oldest)
+
+
+class Stage(threading.Thread):
+    """
+    A worker thread that applies `work` to every item from `inbox`.
+
+    Results other than None are passed on to `outbox`, if there is one. An exception in
+    `work` stops the stage and is kept in `error` for the owner to re-raise. Each item's
+    processing time is recorded as a span named after the stage if `metrics` is given.
+    """
+    def __init__(self, name, work, inbox, outbox=None, metrics=None):
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.metrics = metrics
+        self.error = None
+        self.last_duration = 0.0
+
+    def run(self):
+        try:
+            while True:
+                item = self.inbox.get()
+                t0 = time.perf_counter_ns()
+                result = self.work(item)
+                t1 = time.perf_counter_ns()
+                self.last_duration = (t1 - t0) / 1e9
+                if self.metrics is not None:
+                    self.metrics.record(self.name, t0, t1)
+                if self.outbox is not None and result is not None:
+                    self.outbox.put_latest(result)
+        except Exception as e:
+            self.error = e
+            raise
+
+
+class VideoPipeline:
+    """
+    Encodes and sends frames on two worker threads: main thread -> encode -> send.
+
+    The caller fills a buffer from get_buffer() with the next frame and passes it to submit().
+    Buffers come from a fixed pool and only return to it once their frame has been sent or
+    dropped, so frames never need copying between stages. With one slot in each queue a frame
+    is at most about two frames old by the time it's sent.
+
+    Frames from a stateful codec (see video_codecs.py) are never dropped once encoded, as the
+    frames after them are encoded relative to them. Instead the encode stage waits for the
+    send stage to take each one, so frames are only dropped before they're encoded.
+
+    `codec` and `scale` can be changed at any time and apply from the next frame encoded. With
+    `scale` above 1 every scale'th pixel across and down is encoded.
+    """
+    def __init__(self, codec, packetizer, sock, addr, frame_shape, depth=1, metrics=None):
+        self.codec = codec
+        self.scale = 1
+        self.packetizer = packetizer
+        self.sock = sock
+        self.addr = addr
+
+        # Enough for a frame waiting in, and a frame being worked on by, each stage plus the
+        # one the caller is filling
+        self.free_buffers = queue.Queue()
+        for _ in range(2 * depth + 3):
+            self.free_buffers.put(np.empty(frame_shape, dtype='uint8'))
+
+        def free(item):
+            self.free_buffers.put(item[0])
+        self.encode_queue = LatestQueue(depth, on_drop=free)
+        self.send_queue = LatestQueue(depth, on_drop=free)
+        self.stages = [
+            Stage('encode', self._encode, self.encode_queue, self.send_queue, metrics),
+            Stage('send', self._send, self.send_queue, metrics=metrics),
+        ]
+
+        self.last_codec_name = codec.name
+        self.last_frame_bytes = 0
+
+        for stage in self.stages:
+            stage.start()
+
+    def _encode(self, item):
+        frame, captured_at = item
+        codec = self.codec
+        scale = self.scale
+        encoded = codec.encode(frame[::scale, ::scale] if scale > 1 else frame)
+        if codec.stateful:
+            self.send_queue.put((frame, encoded, codec, captured_at))
+            return None
+        return frame, encoded, codec, captured_at
+
+    def _send(self, item):
+        frame, encoded, codec, captured_at = item
+        try:
+            self.packetizer.send_frame(
+                self.sock, encoded, self.addr, codec.codec_id, captured_at
+            )
+            self.last_codec_name = codec.name
+            self.last_frame_bytes = self.packetizer.last_frame_bytes
+        finally:
+            self.free_buffers.put(frame)
+
+    def get_buffer(self):
+        """
+        A free frame buffer, waiting for one if they're all in flight.
+        """
+        while True:
+            self.check()
+            try:
+                return self.free_buffers.get(timeout=1)
+            except queue.Empty:
+                pass
+
+    def submit(self, frame, captured_at=None):
+        """
+        Queue a frame from get_buffer() for encoding and sending. `captured_at` is the
+        time.time() it was captured, by default now.
+        """
+        if captured_at is None:
+            captured_at = time.time()
+        self.check()
+        self.encode_queue.put_latest((frame, captured_at))
+
+    @property
+    def frames_dropped(self):
+        return self.encode_queue.dropped + self.send_queue.dropped
+
+    def check(self):
+        """
+        Re-raise the error from any stage that has died.
+        """
+        for stage in self.stages:
+            if stage.error is not None:
+                raise Exception("The {:} stage failed".format(stage.name)) from stage.error
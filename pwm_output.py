@@ -0,0 +1,108 @@
+"""
+PWM outputs for the steering servo and throttle ESC.
+
+PwmOutput sits on top of a backend (the PCA9685 board, or a simulated one for running without
+the hardware) and only talks to it when a channel's value actually changes, re-sending
+unchanged values every `refresh_interval` seconds in case a write was missed. The backend is
+picked with the RPICAR_PWM_BACKEND environment variable, 'pca9685' (the default) or 'sim'.
+"""
+import os
+import time
+
+try:
+    import Adafruit_PCA9685
+except ImportError:
+    Adafruit_PCA9685 = None
+
+from car_control import PWM_FREQUENCY
+
+
+class PCA9685Backend:
+    """
+    The Adafruit PCA9685 board, over I2C.
+    """
+    def __init__(self):
+        if Adafruit_PCA9685 is None:
+            raise Exception(
+                "The pca9685 PWM backend needs Adafruit_PCA9685 to be installed, "
+                "set RPICAR_PWM_BACKEND=sim to run without it"
+            )
+        self.device = Adafruit_PCA9685.PCA9685()
+
+    def set_pwm_freq(self, frequency):
+        self.device.set_pwm_freq(frequency)
+
+    def set_pwm(self, channel, on, off):
+        self.device.set_pwm(channel, on, off)
+
+
+class SimulatedBackend:
+    """
+    A stand-in for the PCA9685 that just records what it's told, for testing without hardware.
+    """
+    def __init__(self):
+        self.frequency = None
+        self.values = {}
+        self.writes = 0
+
+    def set_pwm_freq(self, frequency):
+        self.frequency = frequency
+
+    def set_pwm(self, channel, on, off):
+        self.values[channel] = (on, off)
+        self.writes += 1
+
+
+BACKENDS = {'pca9685': PCA9685Backend, 'sim': SimulatedBackend}
+
+
+class PwmOutput:
+    """
+    Sets PWM channels through `backend`, skipping writes that wouldn't change anything.
+
+    The device is set up once, here, rather than on every update, which would also reset the
+    chip's prescaler each time. Backend writes are timed as 'i2c_write' spans if `metrics` is
+    given.
+    """
+    def __init__(self, backend, frequency=PWM_FREQUENCY, refresh_interval=1.0, metrics=None):
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+        self.write_span = None if metrics is None else metrics.span('i2c_write')
+        self.last_written = {}
+        self.writes = 0
+        self.skipped = 0
+
+        backend.set_pwm_freq(frequency)
+
+    def set(self, channel, value, now=None):
+        """
+        Set `channel` to `value` ticks, returning whether the backend was actually written to.
+        """
+        if now is None:
+            now = time.monotonic()
+        last = self.last_written.get(channel)
+        if last is not None and last[0] == value and now - last[1] < self.refresh_interval:
+            self.skipped += 1
+            return False
+
+        if self.write_span is None:
+            self.backend.set_pwm(channel, 0, value)
+        else:
+            with self.write_span:
+                self.backend.set_pwm(channel, 0, value)
+        self.last_written[channel] = (value, now)
+        self.writes += 1
+        return True
+
+
+def open_pwm(backend=None, **kwargs):
+    """
+    A PwmOutput on the named backend, by default the one from RPICAR_PWM_BACKEND.
+    """
+    if backend is None:
+        backend = os.environ.get('RPICAR_PWM_BACKEND', 'pca9685')
+    if backend not in BACKENDS:
+        raise ValueError(
+            "Unknown PWM backend '{:}', choose from {:}".format(backend, ', '.join(BACKENDS))
+        )
+    return PwmOutput(BACKENDS[backend](), **kwargs)
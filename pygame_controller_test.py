@@ -1,34 +1,11 @@
 import pygame
 
+from hud import TextPrint
+
 # Define some colors
 BLACK    = (   0,   0,   0)
 WHITE    = ( 255, 255, 255)
 
-# This is a simple class that will help us print to the screen
-# It has nothing to do with the joysticks, just outputting the
-# information.
-class TextPrint:
-    def __init__(self):
-        self.reset()
-        self.font = pygame.font.Font(None, 20)
-
-    def print(self, screen, textString):
-        textBitmap = self.font.render(textString, True, BLACK)
-        screen.blit(textBitmap, [self.x, self.y])
-        self.y += self.line_height
-        
-    def reset(self):
-        self.x = 10
-        self.y = 10
-        self.line_height = 15
-        
-    def indent(self):
-        self.x += 10
-        
-    def unindent(self):
-        self.x -= 10
-    
-
 pygame.init()
  
 # Set the width and height of the screen [width,height]
@@ -95,7 +72,7 @@ while done==False:
         
         for i in range( axes ):
             axis = joystick.get_axis( i )
-            textPrint.print(screen, "Axis {} value: {:>6.3f}".format(i, axis) )
+            textPrint.print_value(screen, "Axis {} value: ".format(i), "{:>6.3f}".format(axis) )
         textPrint.unindent()
             
         buttons = joystick.get_numbuttons()
@@ -0,0 +1,77 @@
+"""
+The pygame input backend for the driver station, see control_input.py.
+
+The inputs are kept up to date from pygame's input events rather than by polling the
+keyboard and joystick every tick, so the client can sleep until something actually happens
+and send it on straight away.
+
+Keyboard: a/d steer left/right and the up/down arrows drive forwards/backwards. With a
+joystick, axis 0 steers and axis 2 is the throttle.
+"""
+# pylint: disable=E1101
+import pygame
+
+DEADZONE = 0.15
+WHITE = (255, 255, 255)
+STEERING_AXIS = 0
+THROTTLE_AXIS = 2
+
+
+class PygameInput:
+    """
+    Tracks the steering and throttle inputs, each in [-1, 1], from pygame events.
+
+    Opens a small window, keyboard events only arrive while it has focus.
+    """
+    def __init__(self, size=(200, 100), caption="RPiCar Client"):
+        pygame.init()
+        pygame.joystick.init()
+        if pygame.joystick.get_count() > 0:
+            self.joystick = pygame.joystick.Joystick(0)
+            self.joystick.init()
+        else:
+            self.joystick = None
+
+        # The window is only there to receive keyboard events, it never changes
+        screen = pygame.display.set_mode(size)
+        pygame.display.set_caption(caption)
+        screen.fill(WHITE)
+        pygame.display.flip()
+
+        self.left_right = 0.0
+        self.front_back = 0.0
+        self.keys = set()
+        self.quit = False
+
+    def _key_inputs(self):
+        left_right = (pygame.K_d in self.keys) * 1.0 - (pygame.K_a in self.keys) * 1.0
+        front_back = (pygame.K_UP in self.keys) * 1.0 - (pygame.K_DOWN in self.keys) * 1.0
+        return left_right, front_back
+
+    def handle(self, event):
+        if event.type == pygame.QUIT:
+            self.quit = True
+        elif event.type == pygame.JOYAXISMOTION and self.joystick is not None:
+            if event.axis == STEERING_AXIS:
+                self.left_right = 0.0 if abs(event.value) < DEADZONE else event.value
+            elif event.axis == THROTTLE_AXIS:
+                self.front_back = -1.0 * event.value
+        elif event.type in (pygame.KEYDOWN, pygame.KEYUP) and self.joystick is None:
+            if event.type == pygame.KEYDOWN:
+                self.keys.add(event.key)
+            else:
+                self.keys.discard(event.key)
+            self.left_right, self.front_back = self._key_inputs()
+
+    def wait(self, timeout):
+        """
+        Wait up to `timeout` seconds for input, then handle every event that's waiting.
+        Returns the (steering, throttle) inputs.
+        """
+        # A zero timeout would wait forever
+        event = pygame.event.wait(max(1, int(timeout * 1000)))
+        if event.type != pygame.NOEVENT:
+            self.handle(event)
+            for event in pygame.event.get():
+                self.handle(event)
+        return self.left_right, self.front_back
@@ -23,6 +23,9 @@
 import numpy as np
 import sys, pygame, time
 
+from frame_source import CheckerboardSource
+from hud import TextPrint
+
 pygame.init()  
 
 # Set parameters and constants
@@ -33,41 +36,16 @@ BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 
 
-class TextPrint:
-    def __init__(self):
-        self.reset()
-        self.font = pygame.font.Font(None, 20)
-
-    def print(self, screen, textString):
-        textBitmap = self.font.render(textString, True, BLACK)
-        screen.blit(textBitmap, [self.x, self.y])
-        self.y += self.line_height
-        
-    def reset(self):
-        self.x = imwidth + 10
-        self.y = 10
-        self.line_height = 15
-        
-    def indent(self):
-        self.x += 10
-        
-    def unindent(self):
-        self.x -= 10
-
-
 # Initialize stuff
 screen = pygame.display.set_mode(size)
 pygame.display.set_caption("RPiCar")
 
-random_image = (np.random.rand(imwidth, imheight, 3) * 255).astype(int)
-camera_image = pygame.surfarray.make_surface(random_image).convert()
+frame_source = CheckerboardSource(imwidth, imheight, FPS, dtype='int32')
+camera_image = pygame.surfarray.make_surface(frame_source.frame).convert()
 
-text_print = TextPrint()
+text_print = TextPrint(x=imwidth + 10)
 pygame.joystick.init()
 
-counter = 0
-check_sequence = [WHITE[0], BLACK[0]]
-
 while True:
     t0 = time.time()
 
@@ -81,18 +59,7 @@ while True:
     text_print.reset()
 
     # Get the image to display and draw
-    random_image = np.zeros((imwidth, imheight, 3), dtype='int32')
-    check_color_ndx = 0
-    for w in range(16):
-        for h in range(12):
-            random_image[40*w:40*(w+1), 40*h:40*(h+1), :] = check_sequence[check_color_ndx]
-            check_color_ndx = 1 - check_color_ndx
-        check_color_ndx = 1 - check_color_ndx
-
-    counter += 1
-    if counter >= FPS:
-        counter = 0
-        check_sequence = [check_sequence[1], check_sequence[0]]
+    random_image = frame_source.next_frame()
 
     pygame.surfarray.blit_array(camera_image, random_image)
     screen.blit(camera_image, (0, 0))
@@ -117,7 +84,7 @@ while True:
     
     for i in range(axes):
         axis = joystick.get_axis(i)
-        text_print.print(screen, "Axis {} value: {:>6.3f}".format(i, axis))
+        text_print.print_value(screen, "Axis {} value: ".format(i), "{:>6.3f}".format(axis))
     text_print.unindent()
         
     buttons = joystick.get_numbuttons()
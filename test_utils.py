@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from utils import array_to_buffers, array_to_bytes, bytes_to_array
+
+BASE = np.arange(4 * 5 * 3, dtype='float32').reshape(4, 5, 3)
+
+
+@pytest.mark.parametrize('the_array', [
+    BASE,
+    np.asfortranarray(BASE),
+    BASE.transpose(2, 0, 1),
+    BASE[::-1, :, ::-1],
+    BASE[:, ::2],
+    np.array(3.5),
+    np.empty((0, 4), dtype='int16'),
+    np.array(['abc', 'de']),
+    np.array([True, False]),
+    np.arange(6, dtype='>i4').reshape(2, 3),
+], ids=['c', 'fortran', 'transposed', 'negative strides', 'strided', '0-d', 'empty', 'str',
+        'bool', 'big endian'])
+def test_round_trip(the_array):
+    decoded = bytes_to_array(array_to_bytes(the_array))
+    assert decoded.dtype == the_array.dtype
+    assert decoded.shape == the_array.shape
+    np.testing.assert_array_equal(decoded, the_array)
+
+
+def test_keeps_strides_of_transposed_arrays():
+    the_array = np.asfortranarray(BASE)
+    header, data = array_to_buffers(the_array)
+    assert np.shares_memory(np.frombuffer(data, dtype='uint8'), the_array)
+    assert bytes_to_array(header + bytes(data)).strides == the_array.strides
+
+
+def test_decoded_array_shares_memory_with_buffer():
+    buffer = bytearray(array_to_bytes(BASE))
+    decoded = bytes_to_array(buffer)
+    assert np.shares_memory(decoded, np.frombuffer(buffer, dtype='uint8'))
+    decoded[0, 0, 0] = -1
+    assert bytes_to_array(buffer)[0, 0, 0] == -1
+
+
+def test_truncated_buffer():
+    the_bytes = array_to_bytes(BASE)
+    with pytest.raises(ValueError, match='needs'):
+        bytes_to_array(the_bytes[:-1])
+
+
+@pytest.mark.parametrize('the_array', [
+    np.zeros(3, dtype=[('x', 'f4'), ('y', 'i8')]),
+    np.zeros(3, dtype='V12'),
+    np.zeros(3, dtype='datetime64[ms]'),
+    np.zeros(3, dtype='timedelta64[s]'),
+    np.array([None, 1], dtype=object),
+    np.empty(0, dtype='U123456789'),
+], ids=['structured', 'void', 'datetime', 'timedelta', 'object', 'long dtype'])
+def test_rejects_unserializable(the_array):
+    with pytest.raises(ValueError):
+        array_to_bytes(the_array)
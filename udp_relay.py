@@ -0,0 +1,236 @@
+"""
+A UDP relay that sits between a client and a server and makes the link between them behave
+like a poor network: dropping, delaying, jittering, rate limiting, duplicating and reordering
+datagrams. Point the client at the relay's port instead of the server's.
+
+Each client address gets its own socket towards the server, so replies find their way back to
+the right client, and a client can use several sockets (e.g. the video client's clock sync
+socket). Impairments are given as a comma separated list of settings, e.g.
+
+    loss=0.05,delay=20,jitter=10,rate=8000,queue=100,duplicate=0.01,reorder=0.02,seed=1
+
+    loss       fraction of datagrams dropped
+    delay      one way delay added to every datagram, in ms
+    jitter     up to this many ms more or less delay, at random
+    rate       link rate in kbit/s, 0 for unlimited. Datagrams queue up behind each other.
+    queue      longest the rate limited queue may get, in ms of sending, before datagrams are
+               dropped off its tail
+    duplicate  fraction of datagrams sent twice
+    reorder    fraction of datagrams held back an extra `gap` ms, so ones after them overtake
+    gap        see reorder, in ms
+    seed       random seed, so a run can be repeated exactly
+
+The first list applies from the clients to the server, the second, if given, from the server
+back to the clients, otherwise the same settings apply both ways (with the seed plus one, so
+the two directions don't lose the same datagrams).
+"""
+import heapq
+import random
+import selectors
+import socket
+import sys
+import time
+import types
+
+STATS_INTERVAL = 5.0  # seconds
+MAX_DATAGRAM = 65535
+# So the relay itself doesn't drop bursts of video chunks
+RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024
+
+DEFAULT_IMPAIRMENTS = {
+    'loss': 0.0,
+    'delay': 0.0,
+    'jitter': 0.0,
+    'rate': 0.0,
+    'queue': 200.0,
+    'duplicate': 0.0,
+    'reorder': 0.0,
+    'gap': 10.0,
+    'seed': 0,
+}
+
+
+def parse_impairments(spec):
+    """
+    The impairment settings in a spec like "loss=0.05,delay=20", with defaults for the rest.
+    """
+    settings = dict(DEFAULT_IMPAIRMENTS)
+    for setting in filter(None, spec.split(',')):
+        name, _, value = setting.partition('=')
+        if name not in settings or not value:
+            raise ValueError(
+                "Bad impairment '{:}', settings are {:}".format(
+                    setting, ', '.join(DEFAULT_IMPAIRMENTS)
+                )
+            )
+        settings[name] = int(value) if name == 'seed' else float(value)
+    return settings
+
+
+class LinkModel:
+    """
+    Decides the fate of each datagram going one way over the link: when it's delivered, how
+    many times, or whether it's lost. Given the same seed and the same datagrams at the same
+    times it always decides the same way.
+    """
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, rate=0.0, queue=200.0, duplicate=0.0,
+                 reorder=0.0, gap=10.0, seed=0):
+        self.loss = loss
+        self.delay = delay / 1000
+        self.jitter = jitter / 1000
+        self.bytes_per_second = rate * 1000 / 8
+        self.max_queue = queue / 1000
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.gap = gap / 1000
+        self.random = random.Random(seed)
+        self.busy_until = 0.0
+
+        self.forwarded = 0
+        self.lost = 0
+        self.overflowed = 0
+        self.duplicated = 0
+        self.reordered = 0
+
+    def schedule(self, nbytes, now):
+        """
+        The times, on the time.monotonic() clock, at which to deliver a datagram of `nbytes`
+        that arrived at `now`. Empty if it's lost.
+        """
+        rand = self.random.random
+        if rand() < self.loss:
+            self.lost += 1
+            return []
+
+        departs = now
+        if self.bytes_per_second:
+            start = max(now, self.busy_until)
+            if start - now > self.max_queue:
+                self.overflowed += 1
+                return []
+            departs = self.busy_until = start + nbytes / self.bytes_per_second
+
+        copies = 1
+        if rand() < self.duplicate:
+            copies = 2
+            self.duplicated += 1
+
+        times = []
+        for _ in range(copies):
+            deliver_at = departs + self.delay
+            if self.jitter:
+                deliver_at += self.random.uniform(-self.jitter, self.jitter)
+            if rand() < self.reorder:
+                deliver_at += self.gap
+                self.reordered += 1
+            times.append(max(departs, deliver_at))
+        self.forwarded += 1
+        return times
+
+    def stats(self):
+        return "{:} forwarded, {:} lost, {:} overflowed, {:} duplicated, {:} reordered".format(
+            self.forwarded, self.lost, self.overflowed, self.duplicated, self.reordered
+        )
+
+
+sel = selectors.DefaultSelector()
+# Datagrams waiting to go out, as (delivery time, sequence number, socket, data, address)
+pending = []
+sequence = 0
+upstreams = {}
+
+
+def queue_datagram(link, sock, msg, addr):
+    global sequence
+    for deliver_at in link.schedule(len(msg), time.monotonic()):
+        heapq.heappush(pending, (deliver_at, sequence, sock, msg, addr))
+        sequence += 1
+
+
+def open_socket(addr):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_BYTES)
+    sock.bind(addr)
+    sock.setblocking(False)
+    return sock
+
+
+def relay_from_clients(sock):
+    while True:
+        try:
+            msg, client_addr = sock.recvfrom(MAX_DATAGRAM)
+        except BlockingIOError:
+            return
+        upstream = upstreams.get(client_addr)
+        if upstream is None:
+            print("relaying for", client_addr)
+            upstream = open_socket((listen_addr[0], 0))
+            data = types.SimpleNamespace(client_addr=client_addr)
+            sel.register(upstream, selectors.EVENT_READ, data=data)
+            upstreams[client_addr] = upstream
+        queue_datagram(to_server, upstream, msg, server_addr)
+
+
+def relay_from_server(key):
+    while True:
+        try:
+            msg, _ = key.fileobj.recvfrom(MAX_DATAGRAM)
+        except BlockingIOError:
+            return
+        except ConnectionRefusedError:
+            # ICMP port unreachable from an earlier send, the server isn't up (yet)
+            continue
+        queue_datagram(to_clients, lsock, msg, key.data.client_addr)
+
+
+def deliver_due(now):
+    while pending and pending[0][0] <= now:
+        _, _, sock, msg, addr = heapq.heappop(pending)
+        try:
+            sock.sendto(msg, addr)
+        except (BlockingIOError, ConnectionRefusedError):
+            # As good as lost on a real network
+            pass
+
+
+if len(sys.argv) not in (5, 6, 7):
+    print(
+        "usage:", sys.argv[0],
+        "<listen host> <listen port> <server host> <server port> "
+        "[<impairments> [<return impairments>]]"
+    )
+    sys.exit(1)
+
+listen_addr = (sys.argv[1], int(sys.argv[2]))
+server_addr = (sys.argv[3], int(sys.argv[4]))
+to_server_settings = parse_impairments(sys.argv[5] if len(sys.argv) >= 6 else '')
+to_clients_settings = parse_impairments(sys.argv[6]) if len(sys.argv) == 7 else \
+    dict(to_server_settings, seed=to_server_settings['seed'] + 1)
+to_server = LinkModel(**to_server_settings)
+to_clients = LinkModel(**to_clients_settings)
+
+lsock = open_socket(listen_addr)
+sel.register(lsock, selectors.EVENT_READ, data=None)
+print("relaying", listen_addr, "to", server_addr)
+
+last_stats = time.monotonic()
+try:
+    while True:
+        timeout = max(0.0, pending[0][0] - time.monotonic()) if pending else STATS_INTERVAL
+        events = sel.select(timeout=timeout)
+        for key, mask in events:
+            if key.data is None:
+                relay_from_clients(key.fileobj)
+            else:
+                relay_from_server(key)
+
+        now = time.monotonic()
+        deliver_due(now)
+        if now - last_stats >= STATS_INTERVAL:
+            print("to server:", to_server.stats())
+            print("to clients:", to_clients.stats())
+            last_stats = now
+except KeyboardInterrupt:
+    print("caught keyboard interrupt, exiting")
+finally:
+    sel.close()
@@ -1,14 +1,101 @@
+"""
+Serializing ints and numpy arrays for sending over the network.
+
+A serialized array is an ARRAY_HEADER (dtype string, number of dimensions), the shape and
+byte strides as big endian int32s, then the array's memory. array_to_buffers() gives the
+header and a memoryview over the array's own memory for sending as is, e.g. with sendmsg or
+the video Packetizer, and bytes_to_array() returns an array over the received buffer, so
+neither side copies the data.
+
+Arrays whose memory is a contiguous block in some axis order, like transposes of C or
+Fortran contiguous arrays, are sent with their own strides. Anything else is made contiguous
+first.
+
+Only plain numeric, bool, bytes and str dtypes can be sent. Structured (record), void,
+datetime, timedelta and object arrays are refused up front, as their dtype doesn't fit in the
+header or their memory can't be viewed as bytes.
+"""
 import struct
 import numpy as np
 
+UINT32 = struct.Struct('>I')
+
+ARRAY_HEADER = struct.Struct('>8sB')   # dtype.str, padded with spaces, and ndim
+MAX_DIMS = 16
+
 def int_to_bytes(the_int):
-    return struct.pack('>I', the_int)
+    return UINT32.pack(the_int)
 
 def bytes_to_int(the_bytes):
-    return struct.unpack('>I', the_bytes)[0]
+    return UINT32.unpack(the_bytes)[0]
+
+def _dims_struct(ndim):
+    return struct.Struct('>{:}i'.format(2 * ndim))
+
+def pack_array_header(the_array):
+    """
+    The header describing `the_array`'s dtype, shape and strides.
+    """
+    dtype = the_array.dtype
+    if dtype.hasobject:
+        raise ValueError("Arrays of Python objects can't be serialized")
+    if dtype.fields is not None or dtype.kind in 'VMm':
+        raise ValueError(
+            "Arrays of structured, void, datetime or timedelta dtypes can't be serialized, "
+            "got {:}".format(dtype)
+        )
+    if len(dtype.str) > 8:
+        raise ValueError("The dtype {:} is too long to serialize".format(dtype))
+    if the_array.ndim > MAX_DIMS:
+        raise ValueError("Arrays with more than {:} dimensions can't be serialized".format(MAX_DIMS))
+    dtype = dtype.str.encode('ascii').ljust(8)
+    return (
+        ARRAY_HEADER.pack(dtype, the_array.ndim) +
+        _dims_struct(the_array.ndim).pack(*the_array.shape, *the_array.strides)
+    )
+
+def unpack_array_header(the_bytes):
+    """
+    The (dtype, shape, strides, header size) from the start of a serialized array.
+    """
+    dtype, ndim = ARRAY_HEADER.unpack_from(the_bytes)
+    if ndim > MAX_DIMS:
+        raise ValueError("Bad array header, {:} dimensions".format(ndim))
+    dims = _dims_struct(ndim)
+    values = dims.unpack_from(the_bytes, ARRAY_HEADER.size)
+    return (
+        np.dtype(dtype.decode('ascii').strip()), values[:ndim], values[ndim:],
+        ARRAY_HEADER.size + dims.size
+    )
+
+def array_to_buffers(the_array):
+    """
+    The (header, data) buffers to send for `the_array`. `data` is a byte memoryview over the
+    array's own memory where possible, so it's only valid while the array is unchanged.
+    """
+    # Sorting the axes by stride gives a C contiguous view if the memory is one block
+    order = np.argsort(the_array.strides, kind='stable')[::-1]
+    if min(the_array.strides, default=0) < 0 or \
+            not the_array.transpose(order).flags.c_contiguous:
+        the_array = np.ascontiguousarray(the_array)
+        order = range(the_array.ndim)
+    data = memoryview(the_array.transpose(order)).cast('B') if the_array.size else memoryview(b'')
+    return pack_array_header(the_array), data
 
 def array_to_bytes(the_array):
-    return the_array.to_bytes()
+    return b''.join(array_to_buffers(the_array))
 
-def bytes_to_array(the_bytes, dtype='int32'):
-    return np.frombuffer(the_bytes, dtype=dtype)
+def bytes_to_array(the_bytes):
+    """
+    The array serialized in `the_bytes`, which it shares memory with.
+    """
+    dtype, shape, strides, offset = unpack_array_header(the_bytes)
+    if min(strides, default=0) < 0:
+        raise ValueError("Bad array header, negative strides")
+    extent = dtype.itemsize + sum((dim - 1) * stride for dim, stride in zip(shape, strides)) \
+        if all(shape) else 0
+    if offset + extent > memoryview(the_bytes).nbytes:
+        raise ValueError("The array needs {:} bytes but only {:} were given".format(
+            extent, memoryview(the_bytes).nbytes - offset
+        ))
+    return np.ndarray(shape, dtype=dtype, buffer=the_bytes, offset=offset, strides=strides)
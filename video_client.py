@@ -38,14 +38,25 @@ Start loop:
 import numpy as np
 import sys, pygame, time
 import socket
-import struct
 
-if len(sys.argv) != 4:
-    print(f"Usage: {sys.argv[0]} <host> <port> <myport>")
+from clock_sync import ClockSync, enable_timestamps, latency
+from hud import Hud
+from metrics import open_metrics
+from video_codecs import Decoder
+from video_protocol import CHUNK_SIZE, FEEDBACK_INTERVAL, FrameAssembler, request_stream
+
+if len(sys.argv) not in (4, 5, 6):
+    print(f"Usage: {sys.argv[0]} <host> <port> <myport> [<chunk size> [<FEC group size>]]")
     sys.exit(1)
 host = sys.argv[1]
 port = int(sys.argv[2])
 myport = int(sys.argv[3])
+# Payload bytes per datagram to ask the server for. The default suits Ethernet/Wi-Fi,
+# on loopback much larger chunks (up to ~64k) work
+requested_chunk_size = int(sys.argv[4]) if len(sys.argv) >= 5 else CHUNK_SIZE
+# Send a parity chunk after every this many chunks, so one lost chunk in each group can be
+# rebuilt. 0 turns forward error correction off.
+requested_fec_group = int(sys.argv[5]) if len(sys.argv) == 6 else 0
 server_addr = (host, port)
 
 pygame.init()  
@@ -57,85 +68,142 @@ FPS = 30
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
-class TextPrint:
-    def __init__(self):
-        self.reset()
-        self.font = pygame.font.Font(None, 20)
-
-    def print(self, screen, textString):
-        textBitmap = self.font.render(textString, True, BLACK)
-        screen.blit(textBitmap, [self.x, self.y])
-        self.y += self.line_height
-        
-    def reset(self):
-        self.x = imwidth + 10
-        self.y = 10
-        self.line_height = 15
-        
-    def indent(self):
-        self.x += 10
-        
-    def unindent(self):
-        self.x -= 10
-
-
 # Initialize stuff
 screen = pygame.display.set_mode(size)
 pygame.display.set_caption("RPiCar Client")
-
-random_image = np.zeros((imwidth, imheight, 3), dtype='int32')
-camera_image = pygame.surfarray.make_surface(random_image).convert()
-
-text_print = TextPrint()
+screen.fill(WHITE)
+pygame.display.flip()
+
+image_rect = pygame.Rect((0, 0), imsize)
+hud_rect = pygame.Rect(imwidth, 0, width - imwidth, height)
+# Frames are written straight into the display's pixels when it's a format surfarray can
+# view, otherwise into a 32 bit surface that's then blitted
+direct = screen.get_bitsize() in (24, 32)
+camera_image = None if direct else pygame.Surface(imsize, 0, 32)
+
+# Per-stage timings, dumped to the file named by RPICAR_METRICS if it's set
+metrics = open_metrics()
+
+# The last is from the server capturing a frame to it being on screen here
+SPANS = ('receive', 'reassemble', 'decode', 'blit', 'flip', 'glass_to_glass')
+hud = Hud(hud_rect, [
+    '<-- Image received from server',
+    '',
+    'Times (ms):     p50     p95     p99',
+] + ['  {:}: {{}}'.format(name) for name in SPANS] + [
+    '',
+    "Frames received: {:7d}",
+    "Frames dropped: {:7d}",
+    "Frames late: {:7d}",
+    "Chunks recovered: {:7d}",
+    "Clock offset: {:8.1f} ms",
+    "Round trip: {:6.2f} ms",
+])
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock.bind(('127.0.0.1', myport))
-sock.sendto(b'hiya', server_addr)
+sock.bind(('', myport))
+
+chunk_size, fec_group = request_stream(
+    sock, server_addr, requested_chunk_size, requested_fec_group
+)
+print(f"Connected to server, receiving {chunk_size} byte chunks, FEC group size {fec_group}")
+
+# Clock sync requests go to the server's video port from a socket of their own, so the replies
+# don't get mixed up with the stream
+clock_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+clock_sock.bind(('', 0))
+clock_sock.setblocking(False)
+enable_timestamps(clock_sock)
+clock = ClockSync()
+
+assembler = FrameAssembler(chunk_size, fec_group=fec_group)
+decoder = Decoder()
+last_feedback = time.time()
+last_hud = 0.0
+
+
+def show_frame(frame):
+    """
+    Draw a decoded (width, height, 3) frame into the image area, scaling it if it isn't the
+    same size.
+    """
+    if frame.shape[:2] != imsize:
+        screen.blit(
+            pygame.transform.scale(pygame.surfarray.make_surface(frame), imsize), image_rect
+        )
+        return
+    target = screen if direct else camera_image
+    # The view locks the surface, so it mustn't outlive the copy
+    pixels = pygame.surfarray.pixels3d(target)
+    pixels[:imwidth, :imheight] = frame
+    del pixels
+    if not direct:
+        screen.blit(camera_image, image_rect)
 
-while True:
-    t0 = time.time()
 
+while True:
     # Event loop    
     for event in pygame.event.get():
         if event.type == pygame.QUIT:  
             sys.exit()
-
-    # Reset the screen and text processor
-    screen.fill(WHITE)
-    text_print.reset()
-
-    text_print.print(screen, '<-- Image received from server')
-
-    # Get the image to transmit
-    image_parts = []
-    for i in range(3600):
-        part, addr = sock.recvfrom(258)
-        if not part:
-            raise Exception('connection to server lost')
-        image_parts.append((
-            struct.unpack('>H', part[:2]),
-            part[2:]
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            hud.invalidate()
+            pygame.display.flip()
+
+    # Wait for the next frame. If none turns up in time keep showing the last one, the
+    # server streams without waiting on us so a lost frame doesn't stall anything.
+    receive_start = time.perf_counter_ns()
+    frame_buffer = assembler.receive_frame(sock, timeout=1 / FPS)
+    if frame_buffer is not None:
+        metrics.record('receive', receive_start)
+        metrics.add('reassemble', int(assembler.last_assembly_time * 1e9))
+
+    if time.time() - last_feedback >= FEEDBACK_INTERVAL:
+        sock.sendto(assembler.feedback(), server_addr)
+        last_feedback = time.time()
+    if clock.due(time.monotonic()):
+        clock_sock.sendto(clock.request(), server_addr)
+    clock.drain(clock_sock)
+
+    # Only draw what changed: the image when a new frame arrives, the HUD along with it or
+    # every so often while the stream is stalled
+    t0 = time.time()
+    dirty = []
+    captured_at = None
+    if frame_buffer is not None:
+        # For raw frames there's no copy, the array is a view over the reassembly buffer
+        with metrics.span('decode'):
+            random_image = decoder.decode(assembler.codec_id, frame_buffer)
+        if random_image is not None:
+            with metrics.span('blit'):
+                show_frame(random_image)
+            dirty.append(image_rect)
+            captured_at = assembler.captured_at
+
+    metrics.set_counter('frames_received', assembler.frames_received)
+    metrics.set_counter('frames_dropped', assembler.frames_dropped)
+    metrics.set_counter('frames_late', assembler.frames_late)
+    metrics.set_counter('chunks_received', assembler.chunks_received)
+    metrics.set_counter('bytes_received', assembler.bytes_received)
+    metrics.tick()
+    if dirty or t0 - last_hud >= FEEDBACK_INTERVAL:
+        dirty.append(hud.draw(
+            screen,
+            *[metrics.format(name) for name in SPANS],
+            assembler.frames_received,
+            assembler.frames_dropped,
+            assembler.frames_late,
+            assembler.chunks_recovered,
+            None if clock.offset is None else clock.offset * 1000,
+            None if clock.delay is None else clock.delay * 1000,
         ))
-    sock.sendto(b'g2g!', server_addr)
-    image_parts = sorted(image_parts, key=lambda x: x[0])
-
-    random_image = b''
-    for part in image_parts:
-        random_image += part[1]
-    random_image = np.frombuffer(random_image, dtype='uint8').reshape((imwidth, imheight, 3))
-
-    pygame.surfarray.blit_array(camera_image, random_image)
-    screen.blit(camera_image, (0, 0))
-
-    # Cap the FPS
-    elapsed_time = time.time() - t0
-
-    text_print.print(screen, '')
-    text_print.print(screen, "Frame time: {:.2f} ms".format((elapsed_time * 1000)))
-
-    pygame.display.flip()
-
-    elapsed_time = time.time() - t0
-
-    if ((1 / FPS) - elapsed_time) > 0:
-        time.sleep((1 / FPS) - elapsed_time)
+        last_hud = t0
+
+    if dirty:
+        with metrics.span('flip'):
+            pygame.display.update(dirty)
+        if captured_at is not None:
+            metrics.add_latency(
+                'glass_to_glass',
+                latency(captured_at, None if clock.offset is None else -clock.offset)
+            )
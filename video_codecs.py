@@ -0,0 +1,240 @@
+"""
+Frame codecs for the video stream.
+
+Frames are uint8 arrays in pygame's surfarray layout, i.e. (width, height, 3). A codec turns
+one into a bytes-like object, or a list of them, for the packetizer and back again. Each codec
+has a one byte ID that goes in the chunk header, so the client can decode whatever the server
+chose to send. Every encoded frame says what size it is, so the client doesn't need telling.
+
+A codec whose frames depend on the ones before it is `stateful`, and once one of its frames
+is encoded it has to be sent, or the client can't decode what follows.
+
+Codecs are picked with a spec string of the form "<name>[:<level>]", e.g. "jpeg:75", where
+the level is the JPEG quality, the zlib/PNG compression level or the delta keyframe interval.
+"""
+import struct
+import zlib
+from io import BytesIO
+
+import numpy as np
+
+from utils import array_to_buffers, bytes_to_array, unpack_array_header
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class RawCodec:
+    """
+    No compression, the frame is serialized with utils.array_to_buffers(), so its own memory
+    is sent as is and the decoded frame is a view over the received buffer.
+    """
+    codec_id = 0
+    name = 'raw'
+    stateful = False
+
+    def __init__(self, level=None):
+        pass
+
+    def encode(self, frame):
+        return list(array_to_buffers(frame))
+
+    def decode(self, data):
+        return bytes_to_array(data)
+
+
+class ZlibCodec:
+    """
+    Lossless deflate compression. Works well on the synthetic test frames, not on camera images.
+    """
+    codec_id = 1
+    name = 'zlib'
+    stateful = False
+
+    def __init__(self, level=1):
+        self.level = 1 if level is None else level
+
+    def encode(self, frame):
+        header, data = array_to_buffers(frame)
+        return [header, zlib.compress(data, self.level)]
+
+    def decode(self, data):
+        dtype, shape, strides, offset = unpack_array_header(data)
+        pixels = zlib.decompress(memoryview(data)[offset:])
+        return np.ndarray(shape, dtype=dtype, buffer=pixels, strides=strides)
+
+
+class _PillowCodec:
+    format = None
+    default_level = None
+    stateful = False
+
+    def __init__(self, level=None):
+        if Image is None:
+            raise Exception("The {:} codec needs Pillow to be installed".format(self.name))
+        self.level = self.default_level if level is None else level
+
+    def save_options(self):
+        return {}
+
+    def encode(self, frame):
+        # Pillow wants rows first, i.e. (height, width, 3)
+        image = Image.fromarray(np.ascontiguousarray(frame.transpose(1, 0, 2)))
+        out = BytesIO()
+        image.save(out, format=self.format, **self.save_options())
+        return out.getbuffer()
+
+    def decode(self, data):
+        image = Image.open(BytesIO(data))
+        return np.asarray(image.convert('RGB')).transpose(1, 0, 2)
+
+
+class JpegCodec(_PillowCodec):
+    """
+    Lossy JPEG compression, `level` is the quality (1-95).
+    """
+    codec_id = 2
+    name = 'jpeg'
+    format = 'JPEG'
+    default_level = 75
+
+    def save_options(self):
+        return {'quality': self.level}
+
+
+class PngCodec(_PillowCodec):
+    """
+    Lossless PNG compression, `level` is the zlib compression level (0-9).
+    """
+    codec_id = 3
+    name = 'png'
+    format = 'PNG'
+    default_level = 1
+
+    def save_options(self):
+        return {'compress_level': self.level}
+
+
+class DeltaCodec:
+    """
+    Sends only the tiles that changed since the previous frame, with a full keyframe every
+    `level` frames (and whenever the frame size changes) so the client can recover from loss.
+
+    Frames are split into `tile` x `tile` pixel tiles and compared with the previous frame in
+    one vectorized pass. An encoded frame is a DELTA_HEADER, the big endian uint16 indices of
+    the changed tiles in row major (x, y) tile order, then the zlib compressed pixels of those
+    tiles. The decoder patches its own persistent copy of the frame in place, and skips delta
+    frames that don't follow on from the last frame it applied until the next keyframe.
+
+    Both ends are stateful, so use one instance per stream.
+    """
+    codec_id = 4
+    name = 'delta'
+    stateful = True
+
+    # keyframe, sequence, tile size, width, height, changed tile count
+    DELTA_HEADER = struct.Struct('>BIBHHH')
+
+    def __init__(self, level=30, tile=40):
+        self.keyframe_interval = 30 if level is None else level
+        self.tile = tile
+
+        self.sequence = None
+        self.previous = None
+        self.frame = None
+
+    def _tile_view(self, frame):
+        # (tiles across, tiles down, tile, tile, 3) view, no copy
+        width, height = frame.shape[:2]
+        tile = self.tile
+        if width % tile or height % tile:
+            raise ValueError(
+                "A {:}x{:} frame can't be split into {:} pixel tiles".format(width, height, tile)
+            )
+        return frame.reshape(width // tile, tile, height // tile, tile, 3).swapaxes(1, 2)
+
+    def encode(self, frame):
+        sequence = 0 if self.sequence is None else (self.sequence + 1) & 0xFFFFFFFF
+        keyframe = (
+            self.previous is None or
+            self.previous.shape != frame.shape or
+            sequence % self.keyframe_interval == 0
+        )
+
+        tiles = self._tile_view(frame)
+        if keyframe:
+            changed = np.ones(tiles.shape[:2], dtype=bool)
+            self.previous = np.empty_like(frame)
+        else:
+            changed = (tiles != self._tile_view(self.previous)).any(axis=(2, 3, 4))
+        np.copyto(self.previous, frame)
+        self.sequence = sequence
+
+        indices = np.flatnonzero(changed).astype('>u2')
+        header = self.DELTA_HEADER.pack(
+            keyframe, sequence, self.tile, frame.shape[0], frame.shape[1], len(indices)
+        )
+        pixels = zlib.compress(np.ascontiguousarray(tiles[changed]), 1)
+        return [header, indices, pixels]
+
+    def decode(self, data):
+        """
+        Returns the patched frame, or None if this frame can't be applied.
+        """
+        keyframe, sequence, tile, width, height, count = self.DELTA_HEADER.unpack_from(data)
+        if keyframe:
+            if self.frame is None or self.frame.shape[:2] != (width, height):
+                self.frame = np.zeros((width, height, 3), dtype='uint8')
+        elif self.frame is None or self.sequence is None or \
+                sequence != (self.sequence + 1) & 0xFFFFFFFF:
+            # We missed the frame this one is relative to
+            self.sequence = None
+            return None
+        self.sequence = sequence
+
+        self.tile = tile
+        tiles = self._tile_view(self.frame)
+        indices = np.frombuffer(data, dtype='>u2', count=count, offset=self.DELTA_HEADER.size)
+        pixels = zlib.decompress(memoryview(data)[self.DELTA_HEADER.size + indices.nbytes:])
+        tiles[np.unravel_index(indices, tiles.shape[:2])] = \
+            np.frombuffer(pixels, dtype='uint8').reshape((count, tile, tile, 3))
+        return self.frame
+
+
+CODECS = {
+    codec.name: codec for codec in (RawCodec, ZlibCodec, JpegCodec, PngCodec, DeltaCodec)
+}
+CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+
+
+def make_codec(spec):
+    """
+    Build a codec from a spec string like "raw", "zlib:6" or "jpeg:75".
+    """
+    name, _, level = spec.partition(':')
+    if name not in CODECS:
+        raise ValueError(
+            "Unknown codec '{:}', choose from {:}".format(name, ', '.join(CODECS))
+        )
+    return CODECS[name](int(level) if level else None)
+
+
+class Decoder:
+    """
+    Decodes frames with whichever codec they were encoded with, creating codecs as needed.
+
+    decode() returns None for a frame that can't be shown, e.g. a delta frame whose base
+    frame was lost.
+    """
+    def __init__(self):
+        self.codecs = {}
+
+    def decode(self, codec_id, data):
+        codec = self.codecs.get(codec_id)
+        if codec is None:
+            if codec_id not in CODECS_BY_ID:
+                raise Exception("Received a frame with unknown codec ID {:}".format(codec_id))
+            codec = self.codecs[codec_id] = CODECS_BY_ID[codec_id]()
+        return codec.decode(data)
@@ -0,0 +1,580 @@
+"""
+Shared pieces of the UDP video protocol used by video_server.py and video_client.py.
+
+The client opens the stream with a HELLO datagram carrying the payload size and forward
+error correction group size it would like, and the server answers with a HELLO holding the
+values it will actually use.
+
+Frames are streamed without waiting for acknowledgement. Each encoded frame is sent as a
+sequence of datagrams, each made of a CHUNK_HEADER followed by up to chunk_size bytes of the
+frame. The header carries the frame ID, the chunk index, the number of chunks in the frame,
+the total encoded length in bytes, the ID of the codec (see video_codecs.py) it was
+encoded with and the server's time.time() when the frame was captured, so the receiver can
+size its buffers from the first chunk it sees and tell how old the frame is.
+
+With forward error correction on, every group of `fec_group` data chunks is followed by a
+parity chunk holding the XOR of their payloads, which lets the receiver rebuild any one lost
+chunk per group without asking for it again. Parity chunks carry chunk indices from the chunk
+count upwards, one per group.
+
+Every so often the client sends back a FEEDBACK datagram with the last frame ID it completed,
+its running counts of frames received, dropped and late (slow to reassemble), and the running
+total of time spent reassembling them, which the server can adapt the stream to (see
+bitrate.py). The totals wrap around at 2**32. It can also send clock sync requests (see
+clock_sync.py) to the server's port, which read_feedback() answers.
+"""
+import select
+import socket
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from clock_sync import answer_clock_request, recv_timestamped
+
+HELLO_MAGIC = b'hiya'
+HELLO = struct.Struct('>4sHB')  # magic, chunk size, FEC group size (0 for none)
+
+# frame ID, chunk index, chunk count, frame bytes, codec ID, capture time
+CHUNK_HEADER = struct.Struct('>IHHIBd')
+MAX_CHUNKS = 0xFFFF
+
+# Room for a few frames' worth of chunks, so bursts aren't dropped while the client is busy
+# drawing. Linux silently caps this at net.core.rmem_max.
+RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024
+
+FEEDBACK_MAGIC = b'stat'
+# magic, last complete frame ID, frames received, dropped, late, reassembly time (us)
+FEEDBACK = struct.Struct('>4sIIIII')
+FEEDBACK_INTERVAL = 0.5  # seconds
+# A frame that takes longer than this from its first chunk to its last counts as late
+LATE_ASSEMBLY_TIME = 0.05  # seconds
+# The client repeats its HELLO this often until the server answers, in case either was lost
+HELLO_RETRY_INTERVAL = 1.0  # seconds
+
+Feedback = namedtuple('Feedback', [
+    'frame_id', 'frames_received', 'frames_dropped', 'frames_late', 'assembly_time_us'
+])
+
+# Largest payloads that avoid IP fragmentation on Ethernet (1500 byte MTU, less 20 bytes of
+# IPv4 and 8 bytes of UDP header) and that fit in a single UDP datagram at all
+ETHERNET_CHUNK_SIZE = 1500 - 20 - 8 - CHUNK_HEADER.size
+MAX_CHUNK_SIZE = 65507 - CHUNK_HEADER.size
+MIN_CHUNK_SIZE = 64
+CHUNK_SIZE = ETHERNET_CHUNK_SIZE
+
+# sendmsg lets us hand the header and payload to the kernel as separate buffers, but isn't
+# available everywhere (e.g. Windows)
+HAVE_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+
+def num_chunks(frame_bytes, chunk_size):
+    return (frame_bytes + chunk_size - 1) // chunk_size
+
+
+def frame_delta(frame_id, from_frame_id):
+    """
+    The signed number of frames from `from_frame_id` to `frame_id`, allowing for IDs wrapping
+    around at 2**32.
+    """
+    return ((frame_id - from_frame_id + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+def is_newer(frame_id, than_frame_id):
+    return frame_delta(frame_id, than_frame_id) > 0
+
+
+def clamp_chunk_size(chunk_size):
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, chunk_size))
+
+
+def num_parity_chunks(count, fec_group):
+    return num_chunks(count, fec_group) if fec_group else 0
+
+
+def request_stream(sock, server_addr, chunk_size=CHUNK_SIZE, fec_group=0):
+    """
+    Client side of the handshake. Returns the (chunk size, FEC group size) the server agreed
+    to use.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_BYTES)
+    hello = HELLO.pack(HELLO_MAGIC, clamp_chunk_size(chunk_size), max(0, min(255, fec_group)))
+    try:
+        while True:
+            sock.sendto(hello, server_addr)
+            retry_at = time.monotonic() + HELLO_RETRY_INTERVAL
+            msg = b''
+            # Stray chunks from an earlier stream may still be queued, or the stream may have
+            # started if only the server's HELLO was lost, so read full datagrams
+            while len(msg) != HELLO.size:
+                remaining = retry_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    msg, _ = sock.recvfrom(65535)
+                except socket.timeout:
+                    break
+            if len(msg) != HELLO.size:
+                continue
+            magic, agreed_size, agreed_fec_group = HELLO.unpack(msg)
+            if magic != HELLO_MAGIC:
+                raise Exception("Something went wrong!")
+            return agreed_size, agreed_fec_group
+    finally:
+        sock.settimeout(None)
+
+
+def accept_stream(sock, max_chunk_size=MAX_CHUNK_SIZE):
+    """
+    Server side of the handshake. Waits for a client and returns
+    (client address, chunk size, FEC group size).
+
+    The chunk size is whatever the client asked for, capped at `max_chunk_size`, and the FEC
+    group size is the client's choice. Anything else that arrives first, like FEEDBACK or clock
+    sync requests from a client left over from before a restart, is ignored.
+    """
+    while True:
+        msg, addr = sock.recvfrom(65535)
+        if is_hello(msg):
+            break
+    reply, chunk_size, fec_group = answer_hello(msg, max_chunk_size)
+    sock.sendto(reply, addr)
+    return addr, chunk_size, fec_group
+
+
+def is_hello(msg):
+    return len(msg) == HELLO.size and msg[:4] == HELLO_MAGIC
+
+
+def answer_hello(msg, max_chunk_size=MAX_CHUNK_SIZE):
+    """
+    Check a client's HELLO and work out the stream settings, for servers that do their own
+    socket handling. Returns (reply datagram, chunk size, FEC group size).
+    """
+    if len(msg) != HELLO.size:
+        raise Exception("Something went wrong!")
+    magic, requested_size, fec_group = HELLO.unpack(msg)
+    if magic != HELLO_MAGIC:
+        raise Exception("Something went wrong!")
+
+    chunk_size = clamp_chunk_size(min(requested_size, max_chunk_size))
+    return HELLO.pack(HELLO_MAGIC, chunk_size, fec_group), chunk_size, fec_group
+
+
+class Packetizer:
+    """
+    Splits frames into chunk datagrams and sends them.
+
+    Payloads are memoryview slices of the frame and each datagram is sent as a header/payload
+    pair with sendmsg, packing the header into a single reused buffer, so nothing is allocated,
+    copied or concatenated per chunk. If `fec_group` is set the parity chunks for all groups
+    are computed in one vectorized pass per frame.
+
+    `chunks_sent` and `bytes_sent` are running totals of datagrams and encoded frame bytes.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE, fec_group=0):
+        self.chunk_size = chunk_size
+        self.fec_group = fec_group
+        self.frame_id = 0
+        self.header = bytearray(CHUNK_HEADER.size)
+        self.scratch = memoryview(bytearray(chunk_size))
+        self.last_frame_bytes = 0
+        self.chunks_sent = 0
+        self.bytes_sent = 0
+
+    def _parity(self, view, count):
+        """
+        The XOR of each group of `fec_group` chunks, as a (groups, chunk_size) array.
+        """
+        chunk_size = self.chunk_size
+        group_bytes = self.fec_group * chunk_size
+        data = np.frombuffer(view, dtype='uint8')
+
+        full_groups = len(data) // group_bytes
+        parity = np.zeros((num_parity_chunks(count, self.fec_group), chunk_size), dtype='uint8')
+        if full_groups:
+            np.bitwise_xor.reduce(
+                data[:full_groups * group_bytes].reshape(full_groups, self.fec_group, chunk_size),
+                axis=1, out=parity[:full_groups]
+            )
+        tail = data[full_groups * group_bytes:]
+        if len(tail):
+            padded = np.zeros(num_chunks(len(tail), chunk_size) * chunk_size, dtype='uint8')
+            padded[:len(tail)] = tail
+            np.bitwise_xor.reduce(padded.reshape(-1, chunk_size), axis=0, out=parity[-1])
+        return parity
+
+    def _payloads(self, parts):
+        """
+        Yield the payload of every data chunk of a frame made of the byte memoryviews in
+        `parts`, back to back. Only a chunk that straddles two parts is copied, into a reused
+        scratch buffer.
+        """
+        chunk_size = self.chunk_size
+        scratch = self.scratch
+        filled = 0
+        for ndx, part in enumerate(parts):
+            offset = 0
+            if filled:
+                offset = min(chunk_size - filled, part.nbytes)
+                scratch[filled:filled + offset] = part[:offset]
+                filled += offset
+                if filled < chunk_size:
+                    continue
+                yield scratch
+                filled = 0
+
+            end = part.nbytes if ndx == len(parts) - 1 else \
+                offset + (part.nbytes - offset) // chunk_size * chunk_size
+            for start in range(offset, end, chunk_size):
+                yield part[start:start + chunk_size]
+            if end < part.nbytes:
+                filled = part.nbytes - end
+                scratch[:filled] = part[end:]
+        if filled:
+            yield scratch[:filled]
+
+    def chunks(self, frame, codec_id=0, captured_at=0.0):
+        """
+        Yield the (header, payload) pairs of every datagram for `frame` (any C contiguous
+        buffer, e.g. a numpy array or the output of a codec, or a list of them to send back to
+        back), parity chunks included. `captured_at` is the time.time() the frame was captured.
+
+        The header is a single reused buffer, so each pair must be sent before the next one is
+        taken.
+        """
+        if isinstance(frame, (list, tuple)):
+            parts = [memoryview(part).cast('B') for part in frame]
+            if self.fec_group and len(parts) > 1:
+                # The parity is computed over the whole frame in one go
+                parts = [memoryview(b''.join(parts))]
+        else:
+            parts = [memoryview(frame).cast('B')]
+        frame_bytes = sum(part.nbytes for part in parts)
+        self.last_frame_bytes = frame_bytes
+        self.bytes_sent += frame_bytes
+        chunk_size = self.chunk_size
+        count = num_chunks(frame_bytes, chunk_size)
+        if count + num_parity_chunks(count, self.fec_group) > MAX_CHUNKS:
+            raise ValueError(
+                "A {:} byte frame needs {:} chunks of {:} bytes, at most {:} are supported".format(
+                    frame_bytes, count, chunk_size, MAX_CHUNKS
+                )
+            )
+
+        frame_id = self.frame_id
+        self.frame_id = (frame_id + 1) & 0xFFFFFFFF
+
+        fec_group = self.fec_group
+        parity = self._parity(parts[0], count) if fec_group else None
+
+        header = self.header
+        pack_header = CHUNK_HEADER.pack_into
+        for ndx, payload in enumerate(self._payloads(parts)):
+            pack_header(header, 0, frame_id, ndx, count, frame_bytes, codec_id, captured_at)
+            self.chunks_sent += 1
+            yield header, payload
+
+            if fec_group and (ndx % fec_group == fec_group - 1 or ndx == count - 1):
+                group = ndx // fec_group
+                pack_header(
+                    header, 0, frame_id, count + group, count, frame_bytes, codec_id, captured_at
+                )
+                self.chunks_sent += 1
+                yield header, parity[group]
+
+    def send_frame(self, sock, frame, addr, codec_id=0, captured_at=0.0):
+        """
+        Send all chunks of `frame` to `addr`. Returns the ID the frame was sent with.
+        """
+        frame_id = self.frame_id
+        for header, payload in self.chunks(frame, codec_id, captured_at):
+            send_chunk(sock, header, payload, addr)
+        return frame_id
+
+
+def send_chunk(sock, header, payload, addr):
+    if HAVE_SENDMSG:
+        sock.sendmsg((header, payload), (), 0, addr)
+    else:
+        sock.sendto(bytes(header) + payload, addr)
+
+
+class _PartialFrame:
+    def __init__(self, buffer, count, codec_id, captured_at, started, fec_group, chunk_size):
+        self.buffer = buffer
+        self.codec_id = codec_id
+        self.captured_at = captured_at
+        self.view = memoryview(buffer)
+        self.have = bytearray(count)
+        self.count = count
+        self.received = 0
+        self.started = started
+
+        if fec_group:
+            groups = num_parity_chunks(count, fec_group)
+            self.parity = np.zeros((groups, chunk_size), dtype='uint8')
+            self.have_parity = bytearray(groups)
+            self.group_received = bytearray(groups)
+
+
+class FrameAssembler:
+    """
+    Reassembles frames from their chunks into preallocated buffers.
+
+    Each datagram is received into a scratch packet buffer with recvfrom_into and its payload
+    is written straight to index * chunk_size in its frame's buffer, so no per-chunk objects
+    are created and the chunks never need to be sorted or concatenated.
+
+    With `fec_group` set, a group missing a single chunk is rebuilt from the group's parity
+    chunk as soon as the rest of the group has arrived.
+
+    Up to `window` frames can be in flight at once. A frame that isn't complete `deadline`
+    seconds after its first chunk arrived is dropped, as are any older frames still in flight
+    when a newer one completes. If chunks have queued up on the socket, e.g. because the
+    caller takes longer to show a frame than the server takes to send one, receive_frame()
+    works through them and returns the newest complete frame, dropping the ones before it.
+    Frame buffers are recycled, so a returned frame is only valid
+    until the next call to receive_frame(). `last_assembly_time` is how long the last frame
+    took to arrive, from its first chunk to its last, in seconds, and `captured_at` the
+    server's time.time() when it was captured. `chunks_received` and `bytes_received` are
+    running totals of datagrams read and encoded bytes of completed frames. Frames that take
+    longer than `late_after` seconds to arrive are counted in `frames_late`.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE, window=3, deadline=0.2, fec_group=0,
+                 late_after=LATE_ASSEMBLY_TIME):
+        self.chunk_size = chunk_size
+        self.fec_group = fec_group
+        self.window = window
+        self.deadline = deadline
+        self.late_after = late_after
+
+        self.frame_id = None
+        self.codec_id = None
+        self.captured_at = 0.0
+        self.buffer = bytearray(0)
+        self.pending = {}
+        self.spare_buffers = []
+        self.packet = bytearray(CHUNK_HEADER.size + chunk_size)
+        self.packet_view = memoryview(self.packet)
+
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.chunks_received = 0
+        self.chunks_recovered = 0
+        self.bytes_received = 0
+        self.frames_late = 0
+        self.assembly_time = 0.0
+        self.last_assembly_time = 0.0
+
+    def _get_buffer(self, frame_bytes):
+        while self.spare_buffers:
+            buffer = self.spare_buffers.pop()
+            if len(buffer) == frame_bytes:
+                return buffer
+        return bytearray(frame_bytes)
+
+    def _recycle(self, partial):
+        if len(self.spare_buffers) < self.window:
+            self.spare_buffers.append(partial.buffer)
+
+    def _expire(self, now):
+        for frame_id, partial in list(self.pending.items()):
+            if now - partial.started > self.deadline:
+                self._recycle(self.pending.pop(frame_id))
+
+    def _add_chunk(self, nbytes, now):
+        """
+        Store the chunk held in the packet buffer. Returns the frame buffer if this completed a frame.
+        """
+        if nbytes < CHUNK_HEADER.size:
+            return None
+        frame_id, ndx, count, frame_bytes, codec_id, captured_at = \
+            CHUNK_HEADER.unpack_from(self.packet)
+        if self.frame_id is not None and not is_newer(frame_id, self.frame_id):
+            # Left over from a frame we've already shown or given up on
+            return None
+
+        partial = self.pending.get(frame_id)
+        if partial is None:
+            self._expire(now)
+            if len(self.pending) >= self.window:
+                oldest = min(self.pending, key=lambda other: frame_delta(other, frame_id))
+                if is_newer(oldest, frame_id):
+                    # The window is full of frames newer than this one
+                    return None
+                self._recycle(self.pending.pop(oldest))
+            partial = _PartialFrame(
+                self._get_buffer(frame_bytes), count, codec_id, captured_at, now,
+                self.fec_group, self.chunk_size
+            )
+            self.pending[frame_id] = partial
+
+        payload = self.packet_view[CHUNK_HEADER.size:nbytes]
+        if ndx >= partial.count:
+            group = ndx - partial.count
+            if not self.fec_group or group >= len(partial.have_parity) or \
+                    partial.have_parity[group]:
+                return None
+            partial.have_parity[group] = 1
+            partial.parity[group, :len(payload)] = payload
+            self._recover(partial, group)
+        else:
+            if partial.have[ndx]:
+                return None
+            partial.have[ndx] = 1
+            offset = ndx * self.chunk_size
+            partial.view[offset:offset + len(payload)] = payload
+            partial.received += 1
+            if self.fec_group:
+                group = ndx // self.fec_group
+                partial.group_received[group] += 1
+                self._recover(partial, group)
+
+        if partial.received < partial.count:
+            return None
+
+        # Complete. Anything older still in flight would be stale by the time it finished.
+        del self.pending[frame_id]
+        for other in list(self.pending):
+            if not is_newer(other, frame_id):
+                self._recycle(self.pending.pop(other))
+
+        if self.frame_id is not None:
+            self.frames_dropped += frame_delta(frame_id, self.frame_id) - 1
+        self.frames_received += 1
+        self.bytes_received += len(partial.buffer)
+        self.frame_id = frame_id
+        self.codec_id = partial.codec_id
+        self.captured_at = partial.captured_at
+        self.last_assembly_time = now - partial.started
+        self.assembly_time += self.last_assembly_time
+        if self.last_assembly_time > self.late_after:
+            self.frames_late += 1
+
+        if len(self.spare_buffers) < self.window:
+            self.spare_buffers.append(self.buffer)
+        self.buffer = partial.buffer
+        return self.buffer
+
+    def _recover(self, partial, group):
+        """
+        Rebuild the one missing data chunk of `group` from its parity, if that's possible now.
+        """
+        first = group * self.fec_group
+        last = min(first + self.fec_group, partial.count)
+        if not partial.have_parity[group] or partial.group_received[group] != last - first - 1:
+            return
+
+        missing = partial.have.index(0, first, last)
+        chunk_size = self.chunk_size
+        start = first * chunk_size
+        end = min(last * chunk_size, len(partial.buffer))
+        missing_start = missing * chunk_size
+        missing_end = min(missing_start + chunk_size, end)
+
+        # XOR of the parity and every other chunk in the group is the missing chunk. The final
+        # chunk of a frame may be short, so pad the group out to whole chunks.
+        group_data = np.zeros((last - first) * chunk_size, dtype='uint8')
+        group_data[:end - start] = np.frombuffer(partial.buffer, dtype='uint8')[start:end]
+        group_data[missing_start - start:missing_end - start] = 0
+        rebuilt = np.bitwise_xor.reduce(group_data.reshape(-1, chunk_size), axis=0)
+        rebuilt ^= partial.parity[group]
+
+        partial.view[missing_start:missing_end] = rebuilt[:missing_end - missing_start]
+        partial.have[missing] = 1
+        partial.received += 1
+        partial.group_received[group] += 1
+        self.chunks_recovered += 1
+
+    def receive_frame(self, sock, timeout=None):
+        """
+        Read chunks from `sock` until a frame is complete and return its (still encoded)
+        buffer. The ID of the codec it was encoded with is left in `codec_id`.
+
+        Returns None if no frame completes within `timeout` seconds (None waits forever).
+        """
+        if timeout is not None:
+            give_up_at = time.monotonic() + timeout
+        while True:
+            if timeout is not None:
+                remaining = give_up_at - time.monotonic()
+                if remaining <= 0:
+                    self._expire(time.monotonic())
+                    return None
+                sock.settimeout(remaining)
+            try:
+                nbytes, _ = sock.recvfrom_into(self.packet)
+            except socket.timeout:
+                continue
+            self.chunks_received += 1
+            frame = self._add_chunk(nbytes, time.monotonic())
+            if frame is not None:
+                return self._skip_to_newest(sock, frame)
+
+    def _skip_to_newest(self, sock, frame):
+        """
+        Having just completed `frame`, read the chunks already waiting on `sock` without
+        blocking and return the newest frame they complete, or `frame` if they don't complete
+        any. The frames passed over count as dropped rather than received, so a backlog shows
+        up in the FEEDBACK instead of quietly adding latency.
+
+        Gives up after `deadline` seconds, in case chunks arrive faster than they can be read.
+        """
+        give_up_at = time.monotonic() + self.deadline
+        while select.select([sock], [], [], 0)[0] and time.monotonic() < give_up_at:
+            nbytes, _ = sock.recvfrom_into(self.packet)
+            self.chunks_received += 1
+            assembly_time = self.last_assembly_time
+            newer = self._add_chunk(nbytes, time.monotonic())
+            if newer is not None:
+                self.frames_received -= 1
+                self.frames_dropped += 1
+                self.assembly_time -= assembly_time
+                if assembly_time > self.late_after:
+                    self.frames_late -= 1
+                frame = newer
+        return frame
+
+    def feedback(self):
+        """
+        A FEEDBACK datagram reporting what has been received so far.
+        """
+        return FEEDBACK.pack(
+            FEEDBACK_MAGIC, self.frame_id or 0, self.frames_received & 0xFFFFFFFF,
+            self.frames_dropped & 0xFFFFFFFF, self.frames_late & 0xFFFFFFFF,
+            int(self.assembly_time * 1e6) & 0xFFFFFFFF
+        )
+
+
+def read_feedback(sock, hello_reply=None):
+    """
+    Drain any queued FEEDBACK datagrams from `sock` without blocking, answering any clock sync
+    requests among them. If `hello_reply` is given it's sent again in answer to a repeated
+    HELLO, in case the client never got it the first time.
+
+    Returns the most recent one as a Feedback tuple, or None if there were none.
+    """
+    latest = None
+    while select.select([sock], [], [], 0)[0]:
+        msg, addr, received_at = recv_timestamped(sock, 65535)
+        answer = answer_clock_request(msg, received_at)
+        if answer is not None:
+            sock.sendto(answer[0], addr)
+            continue
+        if hello_reply is not None and is_hello(msg):
+            sock.sendto(hello_reply, addr)
+            continue
+        latest = parse_feedback(msg) or latest
+    return latest
+
+
+def parse_feedback(msg):
+    """
+    The Feedback tuple in a FEEDBACK datagram, or None if `msg` isn't one.
+    """
+    if len(msg) == FEEDBACK.size and msg[:4] == FEEDBACK_MAGIC:
+        return Feedback(*FEEDBACK.unpack(msg)[1:])
+    return None
@@ -54,19 +54,31 @@ Start loop:
 # each message send a frame ID, frame number and part of the message 
 
 # pylint: disable=E1101
-import numpy as np
 import sys, pygame, time
 import socket
-import struct
-from gzip import GzipFile
-from io import BytesIO
-from uuid import uuid4 as uuid
 
-if len(sys.argv) != 3:
-    print(f"Usage: {sys.argv[0]} <host> <port>")
+from bitrate import ADAPTIVE_CODEC, BitrateController
+from clock_sync import enable_timestamps
+from frame_source import CheckerboardSource
+from hud import Hud
+from metrics import open_metrics
+from pipeline import VideoPipeline
+from video_codecs import make_codec
+from video_protocol import HELLO, HELLO_MAGIC, Packetizer, accept_stream, read_feedback
+
+if len(sys.argv) not in (3, 4):
+    print(
+        f"Usage: {sys.argv[0]} <host> <port> "
+        "[<codec, e.g. raw, zlib:1, jpeg:75, png:1 or adaptive>]"
+    )
     sys.exit(1)
 host = sys.argv[1]
 port = int(sys.argv[2])
+codec_spec = sys.argv[3] if len(sys.argv) == 4 else 'raw'
+# 'adaptive' picks the JPEG quality, frame scale and frame rate to suit the link, from the
+# client's feedback (see bitrate.py)
+bitrate = BitrateController() if codec_spec == ADAPTIVE_CODEC else None
+codec = bitrate.codec if bitrate else make_codec(codec_spec)
 server_addr = (host, port)
 
 pygame.init()  
@@ -78,106 +90,122 @@ FPS = 30
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
-class TextPrint:
-    def __init__(self):
-        self.reset()
-        self.font = pygame.font.Font(None, 20)
-
-    def print(self, screen, textString):
-        textBitmap = self.font.render(textString, True, BLACK)
-        screen.blit(textBitmap, [self.x, self.y])
-        self.y += self.line_height
-        
-    def reset(self):
-        self.x = imwidth + 10
-        self.y = 10
-        self.line_height = 15
-        
-    def indent(self):
-        self.x += 10
-        
-    def unindent(self):
-        self.x -= 10
-
-
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind(server_addr)
+# So clock sync requests are timestamped on arrival, not when the loop gets round to them
+enable_timestamps(sock)
 
 print("Waiting for client connection...")
 
-msg, addr = sock.recvfrom(4)
-
-if msg != b'hiya':
-    raise Exception("Something went wrong!")
+addr, chunk_size, fec_group = accept_stream(sock)
+# Sent again if the client repeats its HELLO, having missed this one
+hello_reply = HELLO.pack(HELLO_MAGIC, chunk_size, fec_group)
 
-print(f"Connected with {addr[0]}:{addr[1]}")
+print(
+    f"Connected with {addr[0]}:{addr[1]}, sending {chunk_size} byte chunks, "
+    f"FEC group size {fec_group}"
+)
 
 # Initialize stuff
 screen = pygame.display.set_mode(size)
 pygame.display.set_caption("RPiCar Server")
 
-random_image = np.zeros((imwidth, imheight, 3), dtype='uint8')
-camera_image = pygame.surfarray.make_surface(random_image).convert()
-
-text_print = TextPrint()
+frame_source = CheckerboardSource(imwidth, imheight, FPS)
+packetizer = Packetizer(chunk_size, fec_group)
+camera_image = pygame.surfarray.make_surface(frame_source.frame).convert()
+
+# Per-stage timings, dumped to the file named by RPICAR_METRICS if it's set
+metrics = open_metrics()
+
+# Encoding and sending happen on worker threads, so frame N+1 is captured and encoded while
+# frame N is still going out
+pipeline = VideoPipeline(
+    codec, packetizer, sock, addr, frame_source.frame.shape, metrics=metrics
+)
+if bitrate is not None:
+    pipeline.scale = bitrate.point.scale
+
+SPANS = ('frame', 'buffer_wait', 'generate', 'encode', 'send', 'blit', 'flip')
+hud = Hud((imwidth, 0, width - imwidth, height), [
+    '<-- Image transmitted to client',
+    '',
+    'Times (ms):     p50     p95     p99',
+] + ['  {:}: {{}}'.format(name) for name in SPANS] + [
+    '',
+    "Codec: {}",
+    "Frame size: {:5d} kB",
+    "Frames skipped: {:7d}",
+    "Frames sent: {:7d}",
+    "Client received: {:7d}",
+    "Client dropped: {:7d}",
+    '',
+    "Operating point: {}",
+    "Link loss: {:5.1f} %",
+    "Link late: {:5.1f} %",
+    "Link load: {:5.2f}",
+])
+feedback = None
 
 # NOTE: Max size for UDP is practially around 500 bytes I guess?
-counter = 0
-check_sequence = [WHITE[0], BLACK[0]]
 
 while True:
     t0 = time.time()
+    frame_start = time.perf_counter_ns()
 
     # Event loop    
     for event in pygame.event.get():
         if event.type == pygame.QUIT:  
             sys.exit()
 
-    # Reset the screen and text processor
-    screen.fill(WHITE)
-    text_print.reset()
-
-    text_print.print(screen, '<-- Image transmitted to client')
-
     # Get the image to transmit
-    random_image = np.zeros((imwidth, imheight, 3), dtype='uint8')
-    check_color_ndx = 0
-    for w in range(16):
-        for h in range(12):
-            random_image[40*w:40*(w+1), 40*h:40*(h+1), :] = check_sequence[check_color_ndx]
-            check_color_ndx = 1 - check_color_ndx
-        check_color_ndx = 1 - check_color_ndx
-
-    pygame.surfarray.blit_array(camera_image, random_image)
-    screen.blit(camera_image, (0, 0))
-    
-    random_image = random_image.tobytes()
-    # bf = BytesIO()
-    # gzf = GzipFile(fileobj=bf)
-    # gzf.write(random_image.tobytes())
-
-    counter += 1
-    if counter >= FPS:
-        counter = 0
-        check_sequence = [check_sequence[1], check_sequence[0]]
-    
-    for i in range(3600):
-        part = struct.pack('>H', i) + random_image[(i * 256):((i + 1) * 256)]
-        sock.sendto(part, addr)
-
-    msg, addr = sock.recvfrom(4)
-    if msg != b'g2g!':
-        raise Exception("Something went wrong!")
-
-    # Cap the FPS
-    elapsed_time = time.time() - t0
-
-    text_print.print(screen, '')
-    text_print.print(screen, "Frame time: {:.2f} ms".format((elapsed_time * 1000)))
-
-    pygame.display.flip()
+    with metrics.span('buffer_wait'):
+        buffer = pipeline.get_buffer()
+    with metrics.span('generate'):
+        random_image = frame_source.next_frame(out=buffer)
+    captured_at = time.time()
+
+    with metrics.span('blit'):
+        pygame.surfarray.blit_array(camera_image, random_image)
+        screen.blit(camera_image, (0, 0))
+
+    pipeline.submit(random_image, captured_at)
+
+    # The client reports back periodically rather than acknowledging every frame, and sends
+    # clock sync requests that are answered here
+    new_feedback = read_feedback(sock, hello_reply)
+    feedback = new_feedback or feedback
+    if bitrate is not None and bitrate.update(new_feedback, time.monotonic()):
+        pipeline.codec = bitrate.codec
+        pipeline.scale = bitrate.point.scale
+
+    metrics.set_counter('frames_sent', packetizer.frame_id)
+    metrics.set_counter('frames_skipped', pipeline.frames_dropped)
+    metrics.set_counter('chunks_sent', packetizer.chunks_sent)
+    metrics.set_counter('bytes_sent', packetizer.bytes_sent)
+    if bitrate is not None:
+        metrics.set_counter('bitrate_level', bitrate.level)
+    metrics.tick()
+    hud.draw(
+        screen,
+        *[metrics.format(name) for name in SPANS],
+        pipeline.last_codec_name,
+        pipeline.last_frame_bytes // 1024,
+        pipeline.frames_dropped,
+        packetizer.frame_id,
+        None if feedback is None else feedback.frames_received,
+        None if feedback is None else feedback.frames_dropped,
+        bitrate.describe() if bitrate else 'fixed',
+        None if bitrate is None or bitrate.loss is None else bitrate.loss * 100,
+        None if bitrate is None or bitrate.late is None else bitrate.late * 100,
+        None if bitrate is None else bitrate.load,
+    )
+
+    with metrics.span('flip'):
+        pygame.display.flip()
+    metrics.record('frame', frame_start)
 
     elapsed_time = time.time() - t0
 
-    if ((1 / FPS) - elapsed_time) > 0:
-        time.sleep((1 / FPS) - elapsed_time)
+    fps = bitrate.point.fps if bitrate else FPS
+    if ((1 / fps) - elapsed_time) > 0:
+        time.sleep((1 / fps) - elapsed_time)